@@ -1,27 +1,44 @@
 import uvicorn
-from fastapi import FastAPI, Request, UploadFile, File, Form, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+from fastapi import FastAPI, Request, UploadFile, File, Form, Depends, BackgroundTasks, Query
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from sqlmodel import SQLModel, Session, create_engine, select
-from models import Professor, ClassRoom, Student, Attendance
+from sqlmodel import SQLModel, Session, select
+from models import Professor, ClassRoom, Student, Attendance, PhotoJob
+from db import create_db_engine, migrate
+from attendance import mark_present, class_summary, student_summary, invalidate
+from export import REPORT_COLUMNS, EXPORT_FORMATS, iter_report_rows, stream_report
 import os
-import requests
-import pandas as pd
+from http_client import ServiceClient
+from live_events import AttendanceBroker
+from jobs import PhotoJobQueue, job_status
+from roster_import import import_roster
+from metrics import Metrics
+import json
 from datetime import datetime
 from contextlib import asynccontextmanager
 
 # --- PATHS ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-STUDENT_DB = os.path.join(BASE_DIR, "student_db")
+STUDENT_DB = os.environ.get("IRIS_STUDENT_DB", os.path.join(BASE_DIR, "student_db"))  # same folder as the AI server
 PROF_DB = os.path.join(BASE_DIR, "prof_db")
 STATIC_DIR = os.path.join(BASE_DIR, "static")
-DATABASE_URL = f"sqlite:///./main_app.db"  # Updated for Windows safety
+DATABASE_URL = os.environ.get("IRIS_DATABASE_URL", f"sqlite:///./main_app.db")  # Updated for Windows safety
 GPU_URL = "http://127.0.0.1:8001"
 
-engine = create_engine(DATABASE_URL)
+engine = create_db_engine(DATABASE_URL)  # WAL + busy_timeout, see db.py
 templates = Jinja2Templates(directory = "templates")
 
+# One pooled keep-alive client to the AI server; class photos get a longer per-call timeout
+ai_client = ServiceClient(GPU_URL, timeout = 30.0, max_concurrency = 32)
+CLASS_PHOTO_TIMEOUT = 300.0
+
+# Request + per-stage latency histograms, served at /metrics
+metrics = Metrics("dashboard")
+
+# Pushes attendance deltas to open dashboards (see /api/live-attendance/{class_id}/stream)
+broker = AttendanceBroker()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -30,10 +47,17 @@ async def lifespan(app: FastAPI):
     if not os.path.exists(STATIC_DIR):
         os.makedirs(STATIC_DIR)
     SQLModel.metadata.create_all(engine)
+    migrate(engine)
+    await ai_client.start()
+    await photo_jobs.start()
     yield
+    await photo_jobs.stop()
+    await ai_client.close()
 
 
 app = FastAPI(lifespan = lifespan)
+metrics.instrument(app)
+os.makedirs(STATIC_DIR, exist_ok = True)  # StaticFiles checks the folder exists when mounted, before lifespan runs
 app.mount("/static", StaticFiles(directory = STATIC_DIR), name = "static")
 
 
@@ -49,6 +73,26 @@ def get_current_prof(request: Request, session: Session = Depends(get_session)):
     return session.get(Professor, int(prof_id))
 
 
+# --- AI SERVER HELPERS ---
+async def precompute_embeddings(class_folder_path: str, student_folder_path: str = None):
+    # Fills the AI server's embedding store so the first selfie doesn't pay for the reference photos.
+    # Without a student folder the whole class is refreshed.
+    data = {'class_folder_path': class_folder_path}
+    if student_folder_path: data['student_folder_path'] = student_folder_path
+    try:
+        await ai_client.post("/enroll", timeout = CLASS_PHOTO_TIMEOUT, data = data)
+    except Exception as e:
+        print(f"Enroll Error: {e}")
+
+
+# --- LIVE ATTENDANCE HELPERS ---
+def publish_student(session: Session, stu: Student):
+    # Call after committing a change to the student's attendance
+    invalidate(stu.classroom_id)
+    row = student_summary(session, stu.id)
+    if row: broker.publish(stu.classroom_id, row.live())
+
+
 # --- LOGIN / REGISTER ---
 @app.get("/", response_class = RedirectResponse)
 def root(): return RedirectResponse("/login")
@@ -102,7 +146,7 @@ def logout():
 
 # --- VIEW 1: ATTENDANCE DASHBOARD ---
 @app.get("/dashboard", response_class = HTMLResponse)
-def dashboard(request: Request, class_id: int = None, prof: Professor = Depends(get_current_prof),
+def dashboard(request: Request, class_id: int = None, job: int = None, prof: Professor = Depends(get_current_prof),
               session: Session = Depends(get_session)):
     if not prof: return RedirectResponse("/login")
     
@@ -110,41 +154,20 @@ def dashboard(request: Request, class_id: int = None, prof: Professor = Depends(
     selected_class = session.get(ClassRoom, class_id) if class_id else None
     attendance_data = []
     today = datetime.now().strftime("%Y-%m-%d")
+    live_cursor = broker.cursor()  # taken before reading, so the stream replays anything newer
     
     if selected_class and selected_class.professor_id == prof.id:
-        students = selected_class.students
-        recs = session.exec(
-            select(Attendance).where(Attendance.classroom_id == class_id, Attendance.date == today)).all()
-        
-        selfie_ids = {r.student_id for r in recs if r.method == "Selfie"}
-        photo_ids = {r.student_id for r in recs if r.method == "ClassPhoto"}
-        manual_ids = {r.student_id for r in recs if r.method == "Manual"}
-        
-        for s in students:
-            status = "Absent"
-            method = "-"
-            alert = ""
-            if s.id in selfie_ids:
-                status, method = "Present", "Selfie"
-            elif s.id in photo_ids:
-                status, method = "Present", "ClassPhoto"
-            elif s.id in manual_ids:
-                status, method = "Present", "Manual"
-            
-            if s.id in selfie_ids and s.id not in photo_ids: alert = "⚠️ SUSPECT: Not in Photo"
-            if s.id in photo_ids and s.id not in selfie_ids:
-                status = "Present"
-                method = "ClassPhoto"
-                alert = "⚠️ Present (Photo), No QR"
-            
-            attendance_data.append(
-                {"roll": s.roll_number, "name": s.name, "status": status, "method": method, "alert": alert})
+        for row in class_summary(session, class_id, today):
+            status, method, alert = row.classify()
+            attendance_data.append({"roll": row.roll, "name": row.name, "status": status, "method": method,
+                                    "alert": alert})
     
     # Renders the ATTENDANCE specific template
     return templates.TemplateResponse("attendance.html", {
         "request": request, "prof": prof, "classes": classes,
         "selected_class": selected_class, "attendance": attendance_data,
-        "today": today, "student_url": "http://10.2.43.53:8002"  # <--- UPDATE YOUR IP HERE
+        "today": today, "live_cursor": live_cursor, "job_id": job,
+        "student_url": "http://10.2.43.53:8002"  # <--- UPDATE YOUR IP HERE
     })
 
 
@@ -181,8 +204,9 @@ def add_class(name: str = Form(...), batch: str = Form(...), prof: Professor = D
 
 
 @app.post("/add-student")
-async def add_student(class_id: int = Form(...), name: str = Form(...), roll: str = Form(...),
-                      files: list[UploadFile] = File(...), session: Session = Depends(get_session)):
+async def add_student(background_tasks: BackgroundTasks, class_id: int = Form(...), name: str = Form(...),
+                      roll: str = Form(...), files: list[UploadFile] = File(...),
+                      session: Session = Depends(get_session)):
     cls = session.get(ClassRoom, class_id)
     cls_folder_name = f"{cls.name}_{cls.batch}".replace(" ", "_")
     stu_folder_name = f"stu_{roll}"
@@ -195,39 +219,114 @@ async def add_student(class_id: int = Form(...), name: str = Form(...), roll: st
     
     session.add(Student(roll_number = roll, name = name, classroom_id = class_id, folder_path = save_path))
     session.commit()
+    invalidate(class_id)
+    background_tasks.add_task(precompute_embeddings, os.path.join(STUDENT_DB, cls_folder_name), save_path)
     # Redirect back to MANAGE page
     return RedirectResponse(f"/manage?class_id={class_id}", status_code = 303)
 
 
-@app.post("/process-class-photo")
-async def process_photo(class_id: int = Form(...), file: UploadFile = File(...),
-                        prof: Professor = Depends(get_current_prof), session: Session = Depends(get_session)):
+@app.post("/import-roster")
+def import_students(background_tasks: BackgroundTasks, class_id: int = Form(...), roster: UploadFile = File(...),
+                    photos: UploadFile = File(...), enroll: bool = Form(True), prof: Professor = Depends(get_current_prof),
+                    session: Session = Depends(get_session)):
+    # Bulk enrollment: roster CSV (roll,name[,folder]) + ZIP of per-student photo folders, see roster_import.py
+    if not prof: return RedirectResponse("/login")
+    if class_id not in [c.id for c in prof.classes]: return {"error": "Class not found"}
     cls = session.get(ClassRoom, class_id)
-    temp_path = "temp_class_photo.jpg"
-    with open(temp_path, "wb") as f:
-        f.write(await file.read())
+    cls_folder = os.path.join(STUDENT_DB, f"{cls.name}_{cls.batch}".replace(" ", "_"))
+    try:
+        report = import_roster(session, class_id, cls_folder, roster.file, photos.file)
+    except Exception as e:
+        return {"error": f"Could not read the roster or archive: {e}"}
     
+    added = sum(1 for r in report if r["ok"])
+    if added:
+        invalidate(class_id)
+        if enroll: background_tasks.add_task(precompute_embeddings, cls_folder)
+    return {"added": added, "failed": len(report) - added, "rows": report}
+
+
+@app.get("/api/enrollment/{class_id}")
+async def enrollment_status(class_id: int, prof: Professor = Depends(get_current_prof),
+                            session: Session = Depends(get_session)):
+    # Reference photo quality feedback from the AI server's enrollment pipeline, keyed by roll number
+    if not prof: return RedirectResponse("/login")
+    if class_id not in [c.id for c in prof.classes]: return {}
+    cls = session.get(ClassRoom, class_id)
     cls_folder = f"{cls.name}_{cls.batch}".replace(" ", "_")
-    target_dir = os.path.join(STUDENT_DB, cls_folder)
-    
     try:
-        resp = requests.post(f"{GPU_URL}/process-class-photo", files = {'file': open(temp_path, 'rb')},
-                             data = {'class_folder_path': target_dir})
-        found_rolls = resp.json().get("found", [])
-        
-        today = datetime.now().strftime("%Y-%m-%d")
-        for roll in found_rolls:
-            stu = session.exec(
-                select(Student).where(Student.classroom_id == class_id, Student.roll_number == roll)).first()
-            if stu:
-                session.add(Attendance(date = today, time = "--", method = "ClassPhoto", status = "Present",
-                                       student_id = stu.id, classroom_id = class_id))
-        session.commit()
+        resp = await ai_client.get("/enrollment-report",
+                                   params = {'class_folder_path': os.path.join(STUDENT_DB, cls_folder)})
+        report = resp.json()
     except Exception as e:
         print(f"GPU Error: {e}")
+        return {}
+    names = {s.roll_number: s.name for s in session.exec(select(Student).where(Student.classroom_id == class_id))}
+    return {stu.replace("stu_", ""): dict(r, name = names.get(stu.replace("stu_", ""), "")) for stu, r in report.items()}
+
+
+async def run_photo_job(job: PhotoJob, progress):
+    # Worker side of /process-class-photo: send the stored photo to the AI server and mark who was found
+    with Session(engine) as session:
+        cls = session.get(ClassRoom, job.classroom_id)
+        target_dir = os.path.join(STUDENT_DB, f"{cls.name}_{cls.batch}".replace(" ", "_"))
     
-    # Redirect to ATTENDANCE page to see results
-    return RedirectResponse(f"/dashboard?class_id={class_id}", status_code = 303)
+    progress("Detecting and matching faces", 0.1)
+    files = {'file': (job.filename, job.image, "application/octet-stream")}
+    with metrics.span("photo_ai_call"):
+        resp = await ai_client.post("/process-class-photo", files = files, timeout = CLASS_PHOTO_TIMEOUT,
+                                    data = {'class_folder_path': target_dir})
+    resp.raise_for_status()
+    body = resp.json()
+    if body.get("stats") is None:
+        raise RuntimeError(body.get("error") or "AI server did not process the photo")
+    found_rolls = body.get("found", [])
+    
+    progress("Marking attendance", 0.8)
+    today = job.created_at[:10]  # the day the photo was uploaded, even if the job resumed later
+    marked = []
+    with Session(engine) as session:
+        with metrics.span("photo_db_commit"):
+            for roll in found_rolls:
+                stu = session.exec(
+                    select(Student).where(Student.classroom_id == job.classroom_id, Student.roll_number == roll)).first()
+                if stu and mark_present(session, stu.id, job.classroom_id, "ClassPhoto", day = today):
+                    marked.append(stu)
+            session.commit()
+        with metrics.span("photo_publish"):
+            for stu in marked: publish_student(session, stu)
+        return {"found": found_rolls, "marked": [stu.roll_number for stu in marked], "faces": body.get("faces", []),
+                "stats": body.get("stats")}
+
+
+# Class photos are queued and processed in the background; state lives in the photojob table
+photo_jobs = PhotoJobQueue(engine, run_photo_job)
+
+
+@app.post("/process-class-photo")
+async def process_photo(class_id: int = Form(...), file: UploadFile = File(...),
+                        prof: Professor = Depends(get_current_prof), session: Session = Depends(get_session)):
+    # Returns at once; the dashboard polls /api/jobs/{id} while the photo is processed
+    with metrics.span("upload"):
+        data = await file.read()
+    with metrics.span("photo_job_submit"):
+        job, _ = photo_jobs.submit(session, class_id, file.filename, data)
+    return RedirectResponse(f"/dashboard?class_id={class_id}&job={job.id}", status_code = 303,
+                            headers = {"X-Job-Id": str(job.id)})
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: int, session: Session = Depends(get_session)):
+    job = session.get(PhotoJob, job_id)
+    if not job: return {"error": "Job not found"}
+    return job_status(job)
+
+
+@app.get("/api/jobs/{job_id}/result")
+def get_job_result(job_id: int, session: Session = Depends(get_session)):
+    job = session.get(PhotoJob, job_id)
+    if not job: return {"error": "Job not found"}
+    return dict(job_status(job), result = json.loads(job.result) if job.result else None)
 
 
 @app.post("/toggle-attendance")
@@ -240,88 +339,78 @@ async def toggle_attendance(class_id: int = Form(...), roll: str = Form(...), se
     if existing:
         session.delete(existing)
         session.commit()
+        publish_student(session, stu)
         return {"status": "Absent", "color": "#c62828"}
     else:
-        session.add(Attendance(date = today, time = "--", method = "Manual", status = "Present", student_id = stu.id,
-                               classroom_id = class_id))
+        mark_present(session, stu.id, class_id, "Manual", day = today)
         session.commit()
+        publish_student(session, stu)
         return {"status": "Present", "color": "#2e7d32"}
 
 
 @app.get("/download-csv/{class_id}")
 def download_csv(class_id: int, prof: Professor = Depends(get_current_prof), session: Session = Depends(get_session)):
-    cls = session.get(ClassRoom, class_id)
+    if not prof: return RedirectResponse("/login")
+    if class_id not in [c.id for c in prof.classes]: return {"error": "Class not found"}
     today = datetime.now().strftime("%Y-%m-%d")
-    cls_folder = f"{cls.name}_{cls.batch}".replace(" ", "_")
-    save_dir = os.path.join(PROF_DB, f"prof_{prof.id}", cls_folder)
-    os.makedirs(save_dir, exist_ok = True)
-    file_path = os.path.join(save_dir, f"attendance_{today}.csv")
-    
-    recs = session.exec(select(Attendance).where(Attendance.classroom_id == class_id, Attendance.date == today)).all()
-    students = session.exec(select(Student).where(Student.classroom_id == class_id)).all()
-    
-    selfie_ids = {r.student_id for r in recs if r.method == "Selfie"}
-    photo_ids = {r.student_id for r in recs if r.method == "ClassPhoto"}
-    manual_ids = {r.student_id for r in recs if r.method == "Manual"}
-    
-    data = []
-    for s in students:
-        status, check = "Absent", "OK"
-        if s.id in selfie_ids or s.id in photo_ids or s.id in manual_ids: status = "Present"
-        if s.id in selfie_ids and s.id not in photo_ids: check = "SUSPECT (No Face in Photo)"
-        data.append([s.roll_number, s.name, status, check])
-    
-    df = pd.DataFrame(data, columns = ["Roll", "Name", "Status", "Verification"])
-    df.to_csv(file_path, index = False)
-    return FileResponse(file_path, filename = f"attendance_{today}.csv")
+    rows = ([r.roll, r.name, *r.report()] for r in class_summary(session, class_id, today))
+    return StreamingResponse(stream_report(rows, ["Roll", "Name", "Status", "Verification"]), media_type = "text/csv",
+                             headers = {"Content-Disposition": f'attachment; filename="attendance_{today}.csv"'})
+
+
+@app.get("/export")
+def export_report(start: str, end: str, class_id: list[int] = Query(...), format: str = "csv",
+                  prof: Professor = Depends(get_current_prof), session: Session = Depends(get_session)):
+    # Multi-day, multi-class report streamed straight from the database (dates are YYYY-MM-DD)
+    if not prof: return RedirectResponse("/login")
+    if format not in EXPORT_FORMATS: return {"error": f"Unsupported format '{format}'"}
+    classes = [(c.id, f"{c.name}_{c.batch}") for c in prof.classes if c.id in class_id]
+    rows = iter_report_rows(engine, classes, start, end)
+    filename = f"attendance_{start}_to_{end}.{format}"
+    return StreamingResponse(stream_report(rows, REPORT_COLUMNS, format), media_type = EXPORT_FORMATS[format],
+                             headers = {"Content-Disposition": f'attachment; filename="{filename}"'})
 
 
 @app.get("/api/live-attendance/{class_id}")
 def get_live_attendance(class_id: int, session: Session = Depends(get_session)):
-    today = datetime.now().strftime("%Y-%m-%d")
-    recs = session.exec(select(Attendance).where(Attendance.classroom_id == class_id, Attendance.date == today)).all()
-    students = session.exec(select(Student).where(Student.classroom_id == class_id)).all()
-    
-    present_ids = {r.student_id for r in recs}
-    selfie_ids = {r.student_id for r in recs if r.method == "Selfie"}
-    photo_ids = {r.student_id for r in recs if r.method == "ClassPhoto"}
-    
-    data = []
-    for s in students:
-        status, method, alert, color, is_present = "Absent", "-", "", "#c62828", False
-        if s.id in present_ids:
-            status, color, is_present = "Present", "#2e7d32", True
-            rec = next(r for r in recs if r.student_id == s.id)
-            method = rec.method
-        
-        if s.id in selfie_ids and s.id not in photo_ids: alert = "⚠️ SUSPECT: Not in Photo"
-        if s.id in photo_ids and s.id not in selfie_ids:
-            status, method, alert, color, is_present = "Present", "ClassPhoto", "⚠️ Present (Photo), No QR", "#2e7d32", True
-        
-        data.append({"roll": s.roll_number, "status": status, "method": method, "alert": alert, "color": color,
-                     "is_present": is_present})
-    return data
+    return [row.live() for row in class_summary(session, class_id)]
+
+
+@app.get("/api/live-attendance/{class_id}/stream")
+async def stream_live_attendance(class_id: int, request: Request, last_event_id: str = None):
+    # Server-Sent Events: one "attendance" event (a full row for one student) per change.
+    # Browsers resend the last seen id on reconnect; the page passes its render-time cursor on first connect.
+    cursor = request.headers.get("last-event-id") or last_event_id
+    return StreamingResponse(broker.stream(class_id, cursor), media_type = "text/event-stream",
+                             headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.post("/verify-student-proxy")
 async def verify_proxy(file: UploadFile = File(...), class_id: int = Form(...), roll_number: str = Form(...)):
-    with Session(engine) as session:
+    # Sessions are kept out of the AI call: a pooled connection held across the await would let a burst of
+    # selfies exhaust the pool and block the event loop on checkout
+    with metrics.span("db_lookup"), Session(engine) as session:
         stu = session.exec(
             select(Student).where(Student.classroom_id == class_id, Student.roll_number == roll_number)).first()
-        if not stu: return {"match": False, "error": "Student not found"}
-        try:
-            files = {'file': (file.filename, file.file, file.content_type)}
-            resp = requests.post(f"{GPU_URL}/verify-selfie", files = files,
-                                 data = {'student_folder_path': stu.folder_path})
-            if resp.json().get("match"):
-                session.add(
-                    Attendance(date = datetime.now().strftime("%Y-%m-%d"), time = datetime.now().strftime("%H:%M"),
-                               method = "Selfie", status = "Present", student_id = stu.id, classroom_id = class_id))
-                session.commit()
-                return {"match": True}
-        except:
-            pass
-        return {"match": False}
+    if not stu: return {"match": False, "error": "Student not found"}
+    try:
+        with metrics.span("upload"):
+            files = {'file': (file.filename, await file.read(), file.content_type)}
+        with metrics.span("ai_call"):
+            resp = await ai_client.post("/verify-selfie", files = files,
+                                        data = {'student_folder_path': stu.folder_path})
+        if resp.json().get("match"):
+            with Session(engine) as session:
+                with metrics.span("db_commit"):
+                    # A repeat selfie on the same day is a no-op (unique per student/day/method)
+                    mark_present(session, stu.id, class_id, "Selfie", time = datetime.now().strftime("%H:%M"))
+                    session.commit()
+                with metrics.span("publish"):
+                    publish_student(session, stu)
+            return {"match": True}
+    except:
+        pass
+    return {"match": False}
 
 
 if __name__ == "__main__":
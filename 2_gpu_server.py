@@ -1,49 +1,216 @@
 import uvicorn
 from fastapi import FastAPI, UploadFile, File, Form
-from deepface import DeepFace
+from fastapi.responses import JSONResponse
+from workers import InferencePool  # sets TF thread limits, must come before anything importing deepface
 import os
-import shutil
 import numpy as np
-from scipy.spatial.distance import cosine
+from contextlib import asynccontextmanager
+from face_store import GALLERY_DTYPE, get_store, normalize, student_scores, assign_unique
+from embedder import EMBED_BATCH_SIZE, MODEL_ID, warmup, embed_largest_faces
+from detection import detect_and_embed
+from imaging import as_array
+from batcher import MicroBatcher
+from ann_index import CampusIndex
+from enrollment import enroll_paths
+from metrics import Metrics
+import time
+import asyncio
 
-app = FastAPI()
-MODEL = "Facenet512"
+# --- PATHS ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STUDENT_DB = os.environ.get("IRIS_STUDENT_DB", os.path.join(BASE_DIR, "student_db"))  # same folder as the dashboard
 
-# Warmup
-try:
-    DeepFace.represent(img_path = np.zeros((500, 500, 3), dtype = np.uint8), model_name = MODEL,
-                       enforce_detection = False)
-except:
-    pass
+# Request + per-stage latency histograms, served at /metrics
+metrics = Metrics("ai")
+
+# --- CAMPUS INDEX ---
+# Approximate nearest-neighbour index over every class gallery, for identifying students across classes
+ANN_KIND = os.environ.get("IRIS_ANN_INDEX", "ivf")  # "ivf" or "exact"
+ANN_FLUSH_SECONDS = 60
+campus_index = CampusIndex(STUDENT_DB, ANN_KIND)
+
+# --- MATCH THRESHOLDS ---
+# Cosine distance cut-offs. Tuned for the Keras Facenet512 model; re-check them with
+# evaluate_backends.py when switching IRIS_EMBED_BACKEND or IRIS_GALLERY_DTYPE.
+SELFIE_THRESHOLD = float(os.environ.get("IRIS_SELFIE_THRESHOLD", 0.4))  # max distance for a selfie match
+CLASS_PHOTO_THRESHOLD = float(os.environ.get("IRIS_CLASS_PHOTO_THRESHOLD", 0.5))  # max distance in class photos
+
+# --- SELFIE BATCHING ---
+# Selfies arriving within SELFIE_BATCH_WAIT_MS of each other share one embedding pass
+SELFIE_BATCH_SIZE = int(os.environ.get("IRIS_SELFIE_BATCH_SIZE", 16))
+SELFIE_BATCH_WAIT_MS = float(os.environ.get("IRIS_SELFIE_BATCH_WAIT_MS", 20))
+
+
+def embed_selfies(images):
+    with metrics.span("selfie_batch"):
+        return embed_largest_faces(images)
+
+
+selfie_batcher = MicroBatcher(embed_selfies, max_batch = SELFIE_BATCH_SIZE, max_wait_ms = SELFIE_BATCH_WAIT_MS,
+                              name = "selfie")
+
+
+# All model work runs in the pool: "interactive" lane for selfies, "bulk" lane for class photos/enrollment
+pool = InferencePool()
+
+# --- STARTUP / READINESS ---
+# The server accepts connections straight away; the campus index is loaded (or rebuilt) and the
+# models are warmed in the background, and /readyz answers 503 until that (and the optional
+# gallery preload) has finished.
+WARMUP = os.environ.get("IRIS_WARMUP", "full")  # "full" (detector + embedder), "embedder" or "off"
+PRELOAD_CLASSES = os.environ.get("IRIS_PRELOAD_CLASSES", "")  # class folders to load at startup, comma-separated or "*"
+startup = {"campus_index": None, "models": False, "galleries": None, "error": None, "seconds": None}
+models_ready = asyncio.Event()  # model endpoints wait on this (index loaded, models warm) before doing any work
+
+
+async def flush_campus_index():
+    while True:
+        await asyncio.sleep(ANN_FLUSH_SECONDS)
+        await pool.run("bulk", campus_index.flush)
+
+
+def preload_galleries(spec):
+    # Hot classes' embedding galleries are read (and brought up to date) before their first request
+    if not spec or not os.path.isdir(STUDENT_DB): return []
+    names = sorted(os.listdir(STUDENT_DB)) if spec.strip() == "*" else [c.strip() for c in spec.split(",") if c.strip()]
+    loaded = []
+    for name in names:
+        path = os.path.join(STUDENT_DB, name)
+        if name.startswith(".") or not os.path.isdir(path): continue
+        refresh_store(get_store(path))
+        loaded.append(name)
+    return loaded
+
+
+async def warm_start():
+    t0 = time.perf_counter()
+    try:
+        # Before any enrollment can sync into it; a first start or a missing folder means a full rebuild
+        await pool.run("bulk", campus_index.load_or_build)
+        startup["campus_index"] = len(campus_index.index)
+    except Exception as e:
+        startup["error"] = f"Campus index load failed: {e}"
+        print(startup["error"])
+    try:
+        if WARMUP != "off":
+            # On every worker of both lanes (detectors and TFLite interpreters are per thread), at every
+            # batch shape the server will see: single selfie, full selfie batch, class/enrollment chunks
+            await pool.run_on_every_worker(warmup, (1, SELFIE_BATCH_SIZE, EMBED_BATCH_SIZE), WARMUP == "full")
+        startup["models"] = True
+    except Exception as e:
+        startup["error"] = f"Model warmup failed: {e}"
+        print(startup["error"])
+    finally:
+        models_ready.set()
+    try:
+        startup["galleries"] = await pool.run("bulk", preload_galleries, PRELOAD_CLASSES)
+    except Exception as e:
+        startup["galleries"] = []
+        print(f"Gallery preload failed: {e}")
+    startup["seconds"] = round(time.perf_counter() - t0, 2)
+    print(f"AI server ready in {startup['seconds']}s (warmup: {WARMUP}, galleries: {len(startup['galleries'])})")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await pool.start()
+    selfie_batcher.executor = pool.executor("interactive")
+    await selfie_batcher.start()
+    warming = asyncio.create_task(warm_start())
+    flusher = asyncio.create_task(flush_campus_index())
+    yield
+    warming.cancel()
+    flusher.cancel()
+    await selfie_batcher.stop()
+    campus_index.flush()
+    pool.shutdown()
+
+
+app = FastAPI(lifespan = lifespan)
+metrics.instrument(app)
+
+
+def refresh_store(store, students = None):
+    # New/changed reference photos go through the enrollment pipeline (detect, align, quality check,
+    # cached crop, batched embedding) exactly once; every store update also reaches the campus index.
+    # Returns (added, removed, gallery); callers read rows and labels from that one snapshot.
+    return store.refresh(lambda paths: enroll_paths(store, paths), students,
+                         on_change = lambda gallery, added, removed: campus_index.sync(store, gallery, added, removed))
+
+
+def enroll_photos(class_folder_path, student_folder_path):
+    store = get_store(class_folder_path)
+    students = [os.path.basename(os.path.normpath(student_folder_path))] if student_folder_path else None
+    added, removed, gallery = refresh_store(store, students)
+    report = store.report()
+    if students: report = {s: report.get(s, {"accepted": 0, "rejected": []}) for s in students}
+    return {"added": len(added), "removed": len(removed), "total": len(gallery), "students": report}
+
+
+def match_student(target_emb, student_folder_path):
+    # Compare against the student's stored reference embeddings (only new/changed photos get embedded)
+    min_score = 1.0
+    if os.path.exists(student_folder_path):
+        student_folder_path = os.path.normpath(student_folder_path)
+        store = get_store(os.path.dirname(student_folder_path))
+        stu_dir = os.path.basename(student_folder_path)
+        _, _, gallery = refresh_store(store, [stu_dir])
+        refs = gallery.student_matrix(stu_dir)
+        if len(refs):
+            min_score = float(1.0 - np.max(refs @ normalize(target_emb)[0]))
+    return min_score
+
+
+def match_class_photo(img, class_folder_path, detection_mode = None):
+    """
+    Returns (found, faces, stats): matched roll numbers, one {"facial_area", "confidence", "roll",
+    "distance"} per detected face (roll/distance None when unmatched) and the detection report.
+    """
+    # Detection ("full" or "tiled", see detection.py), then all face crops embedded in batches
+    detected, stats = detect_and_embed(as_array(img), detection_mode)
+    t1 = time.perf_counter()
+    faces = [{"facial_area": f["facial_area"], "confidence": f["confidence"], "roll": None, "distance": None}
+             for f in detected]
+    
+    # Every enrollment photo of the class lives in one normalized gallery matrix
+    store = get_store(class_folder_path)
+    gallery = refresh_store(store)[2] if os.path.exists(class_folder_path) else store.gallery
+    
+    if detected and len(gallery):
+        students, sims = student_scores([f["embedding"] for f in detected], gallery.matrix, gallery.labels())
+        for row, col, dist in assign_unique(sims, CLASS_PHOTO_THRESHOLD):
+            faces[row].update(roll = students[col].replace("stu_", ""), distance = dist)
+    stats["timings_ms"]["match"] = 1000 * (time.perf_counter() - t1)
+    return [f["roll"] for f in faces if f["roll"] is not None], faces, stats
+
+
+@app.post("/enroll")
+async def enroll(class_folder_path: str = Form(...), student_folder_path: str = Form(None)):
+    await models_ready.wait()
+    return await pool.run("bulk", enroll_photos, class_folder_path, student_folder_path)
+
+
+@app.get("/enrollment-report")
+def enrollment_report(class_folder_path: str):
+    # Accepted/rejected reference photos per student, as last processed by the enrollment pipeline
+    return get_store(class_folder_path).report()
 
 
 @app.post("/verify-selfie")
 async def verify_selfie(file: UploadFile = File(...), student_folder_path: str = Form(...)):
-    with open("temp.jpg", "wb") as f:
-        shutil.copyfileobj(file.file, f)
-    
     try:
-        # Get embedding of the selfie
-        target_emb = DeepFace.represent("temp.jpg", model_name = MODEL, enforce_detection = True)[0]["embedding"]
-        min_score = 1.0
-        
-        # Check against photos in student's folder
-        if os.path.exists(student_folder_path):
-            for img in os.listdir(student_folder_path):
-                try:
-                    ref_path = os.path.join(student_folder_path, img)
-                    ref_emb = DeepFace.represent(ref_path, model_name = MODEL, enforce_detection = False)[0][
-                        "embedding"]
-                    
-                    score = cosine(target_emb, ref_emb)
-                    if score < min_score:
-                        min_score = score
-                except:
-                    pass
+        await models_ready.wait()
+        # Get embedding of the selfie (batched with other selfies in flight; decoded in memory by the worker)
+        with metrics.span("upload"):
+            data = await file.read()
+        with metrics.span("selfie_embed"):  # queue wait + the batch's detection and embedding
+            target_emb = await selfie_batcher.submit(data)
+        with metrics.span("selfie_match"):
+            min_score = await pool.run("interactive", match_student, target_emb, student_folder_path)
         
         # --- THE FIX IS HERE ---
         # We explicitly convert the numpy result to a Python boolean
-        is_match = bool(min_score < 0.4)
+        is_match = bool(min_score < SELFIE_THRESHOLD)
         
         return {"match": is_match}
     
@@ -53,54 +220,61 @@ async def verify_selfie(file: UploadFile = File(...), student_folder_path: str =
 
 
 @app.post("/process-class-photo")
-async def process_class(file: UploadFile = File(...), class_folder_path: str = Form(...)):
-    with open("temp_class.jpg", "wb") as f:
-        shutil.copyfileobj(file.file, f)
+async def process_class(file: UploadFile = File(...), class_folder_path: str = Form(...),
+                        detection_mode: str = Form(None)):
+    with metrics.span("upload"):
+        data = await file.read()
     
-    found = []
     try:
-        faces = DeepFace.extract_faces("temp_class.jpg", enforce_detection = False)
-        known = {}
-        
-        # Load known embeddings from the class folder
-        if os.path.exists(class_folder_path):
-            for stu_dir in os.listdir(class_folder_path):  # e.g. "stu_1"
-                path = os.path.join(class_folder_path, stu_dir)
-                if os.path.isdir(path):
-                    known[stu_dir] = []
-                    for img in os.listdir(path)[:3]:
-                        try:
-                            emb = \
-                            DeepFace.represent(os.path.join(path, img), model_name = MODEL, enforce_detection = False)[
-                                0]["embedding"]
-                            known[stu_dir].append(emb)
-                        except:
-                            pass
-        
-        for face_obj in faces:
-            face_img = face_obj["face"]
-            if face_img.max() <= 1: face_img = (face_img * 255).astype(np.uint8)
-            face_img = face_img[:, :, ::-1]
-            
-            try:
-                target_emb = DeepFace.represent(face_img, model_name = MODEL, enforce_detection = False)[0]["embedding"]
-                best_score = 0.5
-                best_stu = None
-                
-                for s_id, embs in known.items():
-                    for ref in embs:
-                        score = cosine(target_emb, ref)
-                        if score < best_score:
-                            best_score = score
-                            best_stu = s_id
-                
-                if best_stu:
-                    found.append(best_stu.replace("stu_", ""))
-            except:
-                pass
-    except:
-        pass
-    return {"found": found}
+        await models_ready.wait()
+        found, faces, stats = await pool.run("bulk", match_class_photo, data, class_folder_path, detection_mode)
+    except Exception as e:
+        print(f"GPU Error: {e}")
+        # An error status, not an empty result: the dashboard's job must fail so the photo can be resubmitted
+        return JSONResponse({"found": [], "faces": [], "stats": None, "error": str(e)}, status_code = 500)
+    for stage, ms in stats["timings_ms"].items():
+        metrics.observe(f"class_{stage}", ms / 1000)
+    return {"found": found, "faces": faces, "stats": stats}
+
+
+@app.post("/identify")
+async def identify(file: UploadFile = File(...), k: int = Form(5)):
+    # Campus-wide lookup: which enrolled students (in any class) does this face look like?
+    try:
+        await models_ready.wait()
+        target_emb = await selfie_batcher.submit(await file.read())
+        candidates = await pool.run("interactive", campus_index.identify, target_emb, k)
+    except Exception as e:
+        print(f"Error identifying: {e}")
+        return {"candidates": []}
+    for c in candidates:
+        c["roll"] = c["student"].replace("stu_", "")
+        c["match"] = bool(c["distance"] < SELFIE_THRESHOLD)
+    return {"candidates": candidates}
+
+
+@app.get("/ann-report")
+async def ann_report(queries: int = 200, k: int = 10):
+    # Recall and latency of the campus index against exact search
+    return await pool.run("bulk", campus_index.report, queries, k)
+
+
+@app.get("/healthz")
+def healthz():
+    # Liveness only: the process is up and serving requests
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    ready = startup["campus_index"] is not None and startup["models"] and startup["galleries"] is not None
+    body = dict(startup, ready = ready, warmup = WARMUP, model = MODEL_ID, gallery_dtype = GALLERY_DTYPE)
+    return body if ready else JSONResponse(body, status_code = 503)
+
+
+@app.get("/scheduler-metrics")
+def scheduler_metrics():
+    return selfie_batcher.metrics()
 
 
 if __name__ == "__main__":
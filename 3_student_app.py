@@ -1,21 +1,36 @@
 import uvicorn
 from fastapi import FastAPI, Request, UploadFile, File, Form
 from fastapi.templating import Jinja2Templates
-import requests
+from contextlib import asynccontextmanager
+from http_client import ServiceClient
+from metrics import Metrics
 
-app = FastAPI()
-templates = Jinja2Templates(directory="templates")
 PROF_SERVER = "http://127.0.0.1:8000"
+prof_client = ServiceClient(PROF_SERVER, timeout=30.0, max_concurrency=64)
+metrics = Metrics("student")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await prof_client.start()
+    yield
+    await prof_client.close()
+
+app = FastAPI(lifespan=lifespan)
+metrics.instrument(app)
+templates = Jinja2Templates(directory="templates")
 
 @app.get("/")
 def login(request: Request, cid: str = ""):
     return templates.TemplateResponse("student_login.html", {"request": request, "cid": cid})
 
 @app.post("/verify")
-def verify(class_id: str = Form(...), roll_number: str = Form(...), file: UploadFile = File(...)):
+async def verify(class_id: str = Form(...), roll_number: str = Form(...), file: UploadFile = File(...)):
     try:
-        files = {'file': (file.filename, file.file, file.content_type)}
-        resp = requests.post(f"{PROF_SERVER}/verify-student-proxy", files=files, data={'class_id': class_id, 'roll_number': roll_number})
+        with metrics.span("upload"):
+            files = {'file': (file.filename, await file.read(), file.content_type)}
+        with metrics.span("proxy_call"):
+            resp = await prof_client.post("/verify-student-proxy", files=files, data={'class_id': class_id, 'roll_number': roll_number})
         return resp.json()
     except Exception as e:
         return {"match": False, "error": str(e)}
@@ -0,0 +1,365 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+
+from face_store import normalize, get_store
+from embedder import MODEL, MODEL_ID
+
+# Institution-wide face index. Keys are "<class_dir>/<stu_dir>/<image>", vectors are the
+# L2-normalized embeddings from the per-class stores, so cosine similarity is a dot product.
+INDEX_DIR = ".ann_index"
+
+
+class ExactIndex:
+    """Brute force search over every vector. Also the ground truth for IVFIndex.evaluate()."""
+
+    kind = "exact"
+
+    def __init__(self):
+        self.keys = []  # row -> key (None = free slot)
+        self.rows = {}  # key -> row
+        self.vectors = np.zeros((0, 0), dtype = np.float32)
+        self.free = []
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    # --- MUTATION ---
+    def add(self, keys, vectors):
+        vectors = normalize(vectors)
+        with self.lock:
+            if self.vectors.size == 0:
+                self.vectors = np.zeros((0, vectors.shape[1]), dtype = np.float32)
+            self.remove([k for k in keys if k in self.rows])
+            rows = []
+            for key in keys:
+                row = self.free.pop() if self.free else len(self.keys)
+                if row == len(self.keys): self.keys.append(None)
+                self.keys[row] = key
+                self.rows[key] = row
+                rows.append(row)
+            if len(self.keys) > len(self.vectors):
+                grow = np.zeros((len(self.keys) - len(self.vectors), self.vectors.shape[1]), dtype = np.float32)
+                self.vectors = np.concatenate([self.vectors, grow])
+            self.vectors[rows] = vectors
+            for row in rows: self._on_add(row)
+
+    def remove(self, keys):
+        with self.lock:
+            for key in keys:
+                row = self.rows.pop(key, None)
+                if row is None: continue
+                self._on_remove(row)
+                self.keys[row] = None
+                self.free.append(row)
+
+    def remove_prefix(self, prefix):
+        with self.lock:
+            self.remove([k for k in self.rows if k.startswith(prefix)])
+
+    def _on_add(self, row):
+        pass
+
+    def _on_remove(self, row):
+        pass
+
+    # --- SEARCH ---
+    def _live_rows(self):
+        return np.fromiter(self.rows.values(), dtype = np.int64, count = len(self.rows))
+
+    def _top_k(self, query, rows, k):
+        if len(rows) == 0: return []
+        sims = self.vectors[rows] @ query
+        k = min(k, len(rows))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [(self.keys[rows[i]], float(sims[i])) for i in top]
+
+    def search(self, query, k = 10):
+        query = normalize(query)[0]
+        with self.lock:
+            return self._top_k(query, self._live_rows(), k)
+
+    exact_search = search
+
+    # --- PERSISTENCE ---
+    def _meta(self):
+        return {"kind": self.kind, "model": MODEL_ID, "keys": self.keys}
+
+    def save(self, folder):
+        with self.lock:
+            os.makedirs(folder, exist_ok = True)
+            arrays = {"vectors": self.vectors}
+            arrays.update(self._arrays())
+            with open(os.path.join(folder, "index.npz.tmp"), "wb") as f:
+                np.savez(f, **arrays)
+            with open(os.path.join(folder, "meta.json.tmp"), "w") as f:
+                json.dump(self._meta(), f)
+            os.replace(os.path.join(folder, "index.npz.tmp"), os.path.join(folder, "index.npz"))
+            os.replace(os.path.join(folder, "meta.json.tmp"), os.path.join(folder, "meta.json"))
+
+    def _arrays(self):
+        return {}
+
+    def _restore(self, meta, arrays):
+        self.keys = meta["keys"]
+        self.vectors = arrays["vectors"].astype(np.float32)
+        self.rows = {k: i for i, k in enumerate(self.keys) if k is not None}
+        self.free = [i for i, k in enumerate(self.keys) if k is None]
+
+
+class IVFIndex(ExactIndex):
+    """
+    Inverted-file index: vectors are bucketed under their nearest of nlist k-means centroids and a
+    query only scans the nprobe closest buckets. Until enough vectors exist to train the
+    centroids (min_train) search falls back to exact.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, nlist = 256, nprobe = 16, min_train = 2048):
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self.centroids = None
+        self.assign = np.zeros(0, dtype = np.int64)  # row -> bucket (-1 = free/unassigned)
+        self.buckets = []
+        self.trained_size = 0
+
+    def _bucket_of(self, vecs):
+        return np.argmax(vecs @ self.centroids.T, axis = 1)
+
+    def train(self, iterations = 10, seed = 0):
+        with self.lock:
+            rows = self._live_rows()
+            if len(rows) < self.nlist: return
+            data = self.vectors[rows]
+            rng = np.random.default_rng(seed)
+            sample = data[rng.choice(len(data), min(len(data), self.nlist * 64), replace = False)]
+            centroids = sample[rng.choice(len(sample), self.nlist, replace = False)]
+            # Spherical k-means: assign by dot product, re-normalize the means
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis = 1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                empty = np.bincount(labels, minlength = self.nlist) == 0
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+                centroids = normalize(sums)
+            self.centroids = centroids
+            self.trained_size = len(rows)
+            self._rebuild_buckets()
+
+    def _rebuild_buckets(self):
+        self.assign = np.full(len(self.keys), -1, dtype = np.int64)
+        self.buckets = [[] for _ in range(self.nlist)]
+        rows = self._live_rows()
+        if len(rows) == 0: return
+        self.assign[rows] = self._bucket_of(self.vectors[rows])
+        for row, b in zip(rows, self.assign[rows]):
+            self.buckets[b].append(int(row))
+
+    def _on_add(self, row):
+        if self.centroids is None: return
+        if len(self.assign) < len(self.keys):
+            self.assign = np.concatenate([self.assign, np.full(len(self.keys) - len(self.assign), -1)])
+        b = int(self._bucket_of(self.vectors[row][None, :])[0])
+        self.assign[row] = b
+        self.buckets[b].append(row)
+
+    def _on_remove(self, row):
+        if self.centroids is None or row >= len(self.assign) or self.assign[row] < 0: return
+        self.buckets[self.assign[row]].remove(row)
+        self.assign[row] = -1
+
+    def add(self, keys, vectors):
+        with self.lock:
+            super().add(keys, vectors)
+            # Train once there's enough data, retrain when the gallery has grown 4x since
+            if len(self) >= self.min_train and (self.centroids is None or len(self) > 4 * self.trained_size):
+                self.train()
+
+    def search(self, query, k = 10):
+        with self.lock:
+            if self.centroids is None:
+                return super().search(query, k)
+            query = normalize(query)[0]
+            probes = np.argsort(-(self.centroids @ query))[:self.nprobe]
+            rows = [r for b in probes for r in self.buckets[b]]
+            return self._top_k(query, np.asarray(rows, dtype = np.int64), k)
+
+    def exact_search(self, query, k = 10):
+        return ExactIndex.search(self, query, k)
+
+    def _meta(self):
+        meta = super()._meta()
+        meta.update({"nlist": self.nlist, "nprobe": self.nprobe, "min_train": self.min_train,
+                     "trained_size": self.trained_size})
+        return meta
+
+    def _arrays(self):
+        return {"centroids": self.centroids} if self.centroids is not None else {}
+
+    def _restore(self, meta, arrays):
+        super()._restore(meta, arrays)
+        self.nlist, self.nprobe, self.min_train = meta["nlist"], meta["nprobe"], meta["min_train"]
+        self.trained_size = meta["trained_size"]
+        if "centroids" in arrays:
+            self.centroids = arrays["centroids"].astype(np.float32)
+            self._rebuild_buckets()
+
+
+INDEX_KINDS = {"exact": ExactIndex, "ivf": IVFIndex}
+
+
+def make_index(kind = "ivf", **params):
+    return INDEX_KINDS[kind](**params)
+
+
+def load_index(folder, kind = "ivf", **params):
+    meta_path = os.path.join(folder, "meta.json")
+    if not os.path.exists(meta_path):
+        return make_index(kind, **params)
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    if meta.get("model", f"keras:{MODEL}") != MODEL_ID:
+        return make_index(kind, **params)  # built from another embedding model, rebuild
+    if meta["kind"] != kind or any(meta.get(name) != value for name, value in params.items()):
+        return make_index(kind, **params)  # IRIS_ANN_INDEX or its parameters changed, rebuild
+    index = INDEX_KINDS[meta["kind"]]()
+    with np.load(os.path.join(folder, "index.npz")) as data:
+        index._restore(meta, {k: data[k] for k in data.files})
+    return index
+
+
+def evaluate(index, queries, k = 10):
+    """Recall@k and per-query latency of index.search() against exact search."""
+    queries = normalize(queries)
+    hits, ann_t, exact_t = 0, 0.0, 0.0
+    for q in queries:
+        t0 = time.perf_counter()
+        approx = {key for key, _ in index.search(q, k)}
+        t1 = time.perf_counter()
+        truth = {key for key, _ in index.exact_search(q, k)}
+        t2 = time.perf_counter()
+        ann_t += t1 - t0
+        exact_t += t2 - t1
+        hits += len(approx & truth) / max(1, len(truth))
+    n = max(1, len(queries))
+    return {"kind": index.kind, "size": len(index), "queries": len(queries), "k": k,
+            f"recall@{k}": hits / n, "ann_ms": 1000 * ann_t / n, "exact_ms": 1000 * exact_t / n}
+
+
+class CampusIndex:
+    """
+    Keeps an index over every class store under student_db in step with enrollment and
+    persists it to student_db/.ann_index. Writes are flushed lazily (flush()) since a
+    campus-sized index is too big to rewrite on every new photo.
+    """
+
+    def __init__(self, student_db, kind = "ivf", **params):
+        self.student_db = student_db
+        self.folder = os.path.join(student_db, INDEX_DIR)
+        self.kind = kind
+        self.params = params
+        self.index = make_index(kind, **params)
+        self.dirty = False
+
+    def load_or_build(self):
+        try:
+            self.index = load_index(self.folder, self.kind, **self.params)
+        except Exception as e:
+            print(f"ANN index unreadable, rebuilding: {e}")
+            self.index = make_index(self.kind, **self.params)
+        if len(self.index) == 0:
+            self.rebuild()
+        else:
+            self.reconcile()
+
+    def classes(self):
+        if not os.path.isdir(self.student_db): return []
+        return [cls for cls in sorted(os.listdir(self.student_db))
+                if not cls.startswith(".") and os.path.isdir(os.path.join(self.student_db, cls))]
+
+    def rebuild(self):
+        # Built from what the class stores already hold; nothing is re-embedded here
+        index = make_index(self.kind, **self.params)
+        for cls in self.classes():
+            gallery = get_store(os.path.join(self.student_db, cls)).gallery
+            if len(gallery):
+                index.add([f"{cls}/{e['student']}/{e['image']}" for e in gallery.entries], gallery.matrix)
+        self.index = index
+        self.dirty = True
+        self.flush()
+
+    def reconcile(self):
+        """
+        Bring a loaded index in line with the class stores. Stores are saved on every refresh but the
+        index only on flush(), so after a crash it can lack photos the stores already hold (refresh()
+        never reports them again), keep removed ones, or hold the old vector of a replaced photo.
+        """
+        classes = self.classes()
+        updated, removed = 0, []
+        for cls in classes:
+            store = get_store(os.path.join(self.student_db, cls))
+            with store.lock:  # sync() runs under the same lock, so no update slips in between
+                gallery = store.gallery
+                keys = [f"{cls}/{e['student']}/{e['image']}" for e in gallery.entries]
+                with self.index.lock:
+                    stale = [key for key in self.index.rows if key.startswith(cls + "/")]
+                    rows = np.array([self.index.rows.get(key, -1) for key in keys], dtype = np.int64)
+                    vecs = normalize(gallery.matrix) if keys else None
+                    same = np.zeros(len(keys), dtype = bool)
+                    if len(keys) and self.index.vectors.size:
+                        found = rows >= 0
+                        same[found] = np.sum(self.index.vectors[rows[found]] * vecs[found], axis = 1) > 0.999
+                gone = sorted(set(stale) - set(keys))
+                todo = np.flatnonzero(~same)
+                self.index.remove(gone)
+                if len(todo): self.index.add([keys[i] for i in todo], vecs[todo])
+                updated += len(todo)
+                removed += gone
+        prefixes = tuple(cls + "/" for cls in classes)
+        orphans = [key for key in list(self.index.rows) if not key.startswith(prefixes)]  # class folder deleted
+        self.index.remove(orphans)
+        removed += orphans
+        if updated or removed:
+            print(f"ANN index reconciled with the class stores: {updated} added/updated, {len(removed)} removed")
+            self.dirty = True
+            self.flush()
+
+    def sync(self, store, gallery, added, removed):
+        # gallery is the snapshot the store published together with added/removed
+        cls = os.path.basename(os.path.normpath(store.root))
+        self.index.remove([f"{cls}/{stu}/{img}" for stu, img in removed])
+        if added:
+            rows = {(e["student"], e["image"]): i for i, e in enumerate(gallery.entries)}
+            self.index.add([f"{cls}/{stu}/{img}" for stu, img in added], gallery.rows([rows[k] for k in added]))
+        self.dirty = True
+
+    def flush(self):
+        if not self.dirty: return
+        self.dirty = False
+        self.index.save(self.folder)
+
+    def identify(self, embedding, k = 5):
+        # Best photo per (class, student); extra neighbours are fetched since one student has several photos
+        best = {}
+        for key, sim in self.index.search(embedding, k * 4):
+            cls, stu, _ = key.split("/", 2)
+            if sim > best.get((cls, stu), -1.0): best[(cls, stu)] = sim
+        ranked = sorted(best.items(), key = lambda kv: -kv[1])[:k]
+        return [{"class_folder": cls, "student": stu, "distance": max(0.0, 1.0 - sim)} for (cls, stu), sim in ranked]
+
+    def report(self, queries = 200, k = 10, seed = 0):
+        with self.index.lock:
+            rows = self.index._live_rows()
+            if len(rows) == 0: return {"kind": self.index.kind, "size": 0}
+            rng = np.random.default_rng(seed)
+            picked = rows[rng.choice(len(rows), min(queries, len(rows)), replace = False)]
+            # Perturbed gallery vectors stand in for fresh selfies of enrolled students
+            sample = self.index.vectors[picked] + rng.normal(0, 0.05, (len(picked), self.index.vectors.shape[1]))
+        return evaluate(self.index, sample, k)
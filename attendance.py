@@ -0,0 +1,124 @@
+import os
+import time
+import threading
+from datetime import datetime
+from typing import NamedTuple
+from sqlalchemy import and_, case, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import select
+from models import Attendance, Student
+
+# Dashboard, live API and exports read the same per-class summary; it is cached briefly and
+# dropped by invalidate() whenever a class's attendance or roster changes
+SUMMARY_TTL = float(os.environ.get("IRIS_SUMMARY_TTL", 2.0))
+
+
+def today_str():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def mark_present(session, student_id: int, class_id: int, method: str, time: str = "--", day: str = None):
+    """
+    Insert a Present record unless the student already has one for this day and method.
+    Returns True if a row was added. The caller commits.
+    """
+    stmt = insert(Attendance).values(date = day or today_str(), time = time, method = method, status = "Present",
+                                     student_id = student_id, classroom_id = class_id)
+    return session.execute(stmt.on_conflict_do_nothing()).rowcount > 0
+
+
+# --- CLASS SUMMARY ---
+class SummaryRow(NamedTuple):
+    student_id: int
+    roll: str
+    name: str
+    selfie: bool
+    photo: bool
+    manual: bool
+    
+    def classify(self):
+        """(status, method, alert) using the dashboard's rules: Selfie > ClassPhoto > Manual."""
+        status, method, alert = "Absent", "-", ""
+        if self.selfie:
+            status, method = "Present", "Selfie"
+        elif self.photo:
+            status, method = "Present", "ClassPhoto"
+        elif self.manual:
+            status, method = "Present", "Manual"
+        
+        if self.selfie and not self.photo: alert = "⚠️ SUSPECT: Not in Photo"
+        if self.photo and not self.selfie: alert = "⚠️ Present (Photo), No QR"
+        return status, method, alert
+    
+    def report(self):
+        """(status, verification) as written to exported reports."""
+        status = "Present" if (self.selfie or self.photo or self.manual) else "Absent"
+        check = "SUSPECT (No Face in Photo)" if self.selfie and not self.photo else "OK"
+        return status, check
+    
+    def live(self):
+        status, method, alert = self.classify()
+        present = status == "Present"
+        return {"roll": self.roll, "status": status, "method": method, "alert": alert,
+                "color": "#2e7d32" if present else "#c62828", "is_present": present}
+
+
+def _has(method):
+    return func.max(case((Attendance.method == method, 1), else_ = 0))
+
+
+def summary_query(day: str):
+    # Students LEFT JOIN the day's attendance, one row per student with a flag per method
+    return (select(Student.id, Student.roll_number, Student.name,
+                   _has("Selfie"), _has("ClassPhoto"), _has("Manual"))
+            .select_from(Student)
+            .join(Attendance, and_(Attendance.student_id == Student.id, Attendance.date == day), isouter = True)
+            .group_by(Student.id)
+            .order_by(Student.id))
+
+
+def _to_row(r):
+    return SummaryRow(r[0], r[1], r[2], bool(r[3]), bool(r[4]), bool(r[5]))
+
+
+def iter_summary(session, class_id: int, day: str, yield_per: int = 500):
+    # Streams rows from a server-side cursor, for exports that must not hold a whole class in memory
+    stmt = summary_query(day).where(Student.classroom_id == class_id).execution_options(yield_per = yield_per)
+    for r in session.exec(stmt):
+        yield _to_row(r)
+
+
+def session_days(session, class_id: int, start: str, end: str):
+    """Days in [start, end] on which the class has any attendance record, i.e. days it met."""
+    return session.exec(select(Attendance.date).where(Attendance.classroom_id == class_id, Attendance.date >= start,
+                                                      Attendance.date <= end).distinct().order_by(Attendance.date)).all()
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def class_summary(session, class_id: int, day: str = None, use_cache: bool = True):
+    day = day or today_str()
+    key = (class_id, day)
+    if use_cache:
+        with _cache_lock:
+            hit = _cache.get(key)
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+    rows = [_to_row(r) for r in session.exec(summary_query(day).where(Student.classroom_id == class_id)).all()]
+    if use_cache:
+        with _cache_lock:
+            _cache[key] = (time.monotonic() + SUMMARY_TTL, rows)
+    return rows
+
+
+def student_summary(session, student_id: int, day: str = None):
+    r = session.exec(summary_query(day or today_str()).where(Student.id == student_id)).first()
+    return _to_row(r) if r else None
+
+
+def invalidate(class_id: int):
+    with _cache_lock:
+        for key in [k for k in _cache if k[0] == class_id]:
+            del _cache[key]
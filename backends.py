@@ -0,0 +1,100 @@
+import threading
+import cv2
+import numpy as np
+
+# --- EXPORTED-MODEL BACKENDS ---
+# Run a Facenet512 export (see export_model.py) without TensorFlow's Keras path. Exports take the
+# same input DeepFace feeds the Keras model: BGR, letterboxed to 160x160, scaled to [0, 1], NHWC.
+INPUT_SIZE = 160
+
+
+def preprocess(crops, size = INPUT_SIZE):
+    """BGR uint8 crops -> float32 batch (n, size, size, 3), padded like DeepFace's resize_image."""
+    batch = np.zeros((len(crops), size, size, 3), dtype = np.float32)
+    for i, crop in enumerate(crops):
+        h, w = crop.shape[:2]
+        factor = min(size / h, size / w)
+        nh, nw = int(h * factor), int(w * factor)
+        img = cv2.resize(crop, (nw, nh))
+        top, left = (size - nh) // 2, (size - nw) // 2
+        batch[i, top:top + nh, left:left + nw] = img
+    if batch.max() > 1: batch /= 255.0
+    return batch
+
+
+class OnnxBackend:
+    """ONNX Runtime on CPU; float32, float16 (input cast automatically) or dynamically quantized int8."""
+
+    def __init__(self, path, threads = 1):
+        # Optional dependency, only needed when IRIS_EMBED_BACKEND=onnx
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, opts, providers = ["CPUExecutionProvider"])
+        inp = self.session.get_inputs()[0]
+        self.input = inp.name
+        self.half = inp.type == "tensor(float16)"
+
+    def embed(self, crops):
+        x = preprocess(crops)
+        if self.half: x = x.astype(np.float16)
+        return self.session.run(None, {self.input: x})[0].astype(np.float32)
+
+
+class TFLiteBackend:
+    """
+    TFLite float16 or int8 model. Interpreters aren't thread-safe, so each worker thread gets its own,
+    one per batch size: batches are zero-padded up to the next of batch_sizes (warmup() sets them to
+    the sizes it runs), so an interpreter never resizes and reallocates its tensors between calls.
+    """
+
+    def __init__(self, path, threads = 1, batch_sizes = (1, 16, 32)):
+        # Optional dependency: the slim tflite-runtime package, else TensorFlow's bundled interpreter
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.interpreter_cls = Interpreter
+        with open(path, "rb") as f:
+            self.model = f.read()  # one copy shared by every interpreter
+        self.threads = threads
+        self.batch_sizes = sorted(set(batch_sizes))
+        self.local = threading.local()
+
+    def _interpreter(self, batch):
+        interpreters = self.local.__dict__.setdefault("interpreters", {})
+        it = interpreters.get(batch)
+        if it is None:
+            it = interpreters[batch] = self.interpreter_cls(model_content = self.model, num_threads = self.threads)
+            it.resize_tensor_input(it.get_input_details()[0]["index"], (batch, INPUT_SIZE, INPUT_SIZE, 3))
+            it.allocate_tensors()
+        return it
+
+    def embed(self, crops):
+        largest = self.batch_sizes[-1]
+        if len(crops) > largest:
+            return np.concatenate([self.embed(crops[i:i + largest]) for i in range(0, len(crops), largest)])
+        x = preprocess(crops)
+        n = len(x)
+        batch = next(size for size in self.batch_sizes if size >= n)
+        if batch > n: x = np.concatenate([x, np.zeros((batch - n,) + x.shape[1:], dtype = x.dtype)])
+        it = self._interpreter(batch)
+        inp, out = it.get_input_details()[0], it.get_output_details()[0]
+        if inp["dtype"] in (np.int8, np.uint8):
+            scale, zero = inp["quantization"]
+            info = np.iinfo(inp["dtype"])
+            x = np.clip(np.round(x / scale + zero), info.min, info.max).astype(inp["dtype"])
+        else:
+            x = x.astype(inp["dtype"])
+        it.set_tensor(inp["index"], x)
+        it.invoke()
+        y = it.get_tensor(out["index"])
+        if out["dtype"] in (np.int8, np.uint8):
+            scale, zero = out["quantization"]
+            y = (y.astype(np.float32) - zero) * scale
+        return y[:n].astype(np.float32)
+
+
+BACKENDS = {"onnx": OnnxBackend, "tflite": TFLiteBackend}
@@ -0,0 +1,95 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Groups concurrent submit() calls into batches. A batch is flushed when it holds
+    max_batch items or when the oldest item has waited max_wait_ms, then fn(items) runs
+    once in the executor. fn must return one result per item; an Exception instance in
+    that list is raised in the matching caller only.
+    """
+
+    def __init__(self, fn, max_batch = 16, max_wait_ms = 20, executor = None, name = "batcher"):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor or ThreadPoolExecutor(max_workers = 1, thread_name_prefix = name)
+        self.name = name
+        self.queue = None
+        self.task = None
+
+        # --- METRICS ---
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = deque(maxlen = 1000)
+        self.latencies = deque(maxlen = 1000)
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def submit(self, item):
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, fut, time.perf_counter()))
+        return await fut
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0: break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = [b[0] for b in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.fn, items)
+            except Exception as e:
+                results = [e] * len(items)
+
+            now = time.perf_counter()
+            self.batches += 1
+            self.items += len(items)
+            self.batch_sizes.append(len(items))
+            for (_, fut, started), res in zip(batch, results):
+                self.latencies.append(now - started)
+                if fut.done(): continue  # caller went away
+                if isinstance(res, Exception):
+                    fut.set_exception(res)
+                else:
+                    fut.set_result(res)
+
+    def metrics(self):
+        lat = np.asarray(self.latencies) * 1000
+        return {
+            "name": self.name,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            "max_batch_size": max(self.batch_sizes) if self.batch_sizes else 0,
+            "latency_p50_ms": float(np.percentile(lat, 50)) if len(lat) else 0.0,
+            "latency_p99_ms": float(np.percentile(lat, 99)) if len(lat) else 0.0,
+        }
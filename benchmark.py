@@ -0,0 +1,311 @@
+"""
+Offline benchmark for the three services.
+
+DeepFace is replaced by a deterministic stub, so this runs on CPU without the real model and
+measures everything around it: HTTP handling, batching, the worker pool, gallery matching, the
+database and the service-to-service calls. All three apps run in this process, wired together
+with httpx.ASGITransport; data goes to a temporary folder and SQLite file.
+
+    python benchmark.py --classes 2 --students 60 --requests 200 --concurrency 32 --out bench.json
+    python benchmark.py --baseline bench.json   # compare a new run with an earlier one
+
+Synthetic "faces" are 96x96 checkerboard tiles whose mean colour encodes the student, so a
+selfie matches that student's reference photo and a class photo is a grid of tiles.
+"""
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import asyncio
+import argparse
+import tempfile
+import importlib.util
+from datetime import datetime
+import cv2
+import numpy as np
+import httpx
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CELL = 96  # tile size of one synthetic face
+EMBED_DIM = 512
+
+
+# --- STUB FACE MODEL ---
+class StubDeepFace:
+    """Stands in for deepface.DeepFace. detect_ms/embed_ms add simulated per-face model cost."""
+
+    def __init__(self, detect_ms = 0.0, embed_ms = 0.0):
+        self.detect_ms = detect_ms
+        self.embed_ms = embed_ms
+
+    def extract_faces(self, img_path, detector_backend = "opencv", enforce_detection = True, align = True, **kwargs):
+        img = img_path if isinstance(img_path, np.ndarray) else cv2.imread(img_path)
+        h, w = img.shape[:2]
+        faces = []
+        for y in range(0, h - CELL + 1, CELL):
+            for x in range(0, w - CELL + 1, CELL):
+                cell = img[y:y + CELL, x:x + CELL]
+                if cell.std() > 5:  # background is flat, faces are checkerboards
+                    faces.append({"face": cell[:, :, ::-1] / 255.0, "facial_area": {"x": x, "y": y, "w": CELL, "h": CELL},
+                                  "confidence": 0.99})
+        time.sleep(self.detect_ms / 1000)
+        if not faces:
+            if enforce_detection: raise ValueError("Face could not be detected")
+            faces = [{"face": img[:, :, ::-1] / 255.0, "facial_area": {"x": 0, "y": 0, "w": w, "h": h}, "confidence": 0}]
+        return faces
+
+    def represent(self, img_path, model_name = "", detector_backend = "opencv", enforce_detection = True, **kwargs):
+        imgs = img_path if isinstance(img_path, list) else [img_path]
+        out = [[{"embedding": face_embedding(img).tolist(), "facial_area": {}, "face_confidence": 1.0}] for img in imgs]
+        time.sleep(self.embed_ms * len(imgs) / 1000)
+        return out if isinstance(img_path, list) else out[0]
+
+
+def face_color(student):
+    return np.array([40 + 12 * (student % 16), 40 + 12 * (student // 16 % 16), 40 + 12 * (student // 256 % 16)])
+
+
+def face_embedding(img):
+    # Mean colour survives resizing/cropping, so any crop of a student's tile maps back to the same vector
+    q = np.clip(np.round((img.reshape(-1, 3).mean(0) - 40) / 12), 0, 15).astype(int)
+    student = int(q[0] + 16 * q[1] + 256 * q[2])
+    return np.random.default_rng(student).standard_normal(EMBED_DIM).astype(np.float32)
+
+
+def face_tile(student):
+    checker = (np.indices((CELL, CELL)).sum(0) // 4 % 2) * 60 - 30
+    return np.clip(face_color(student)[None, None, :] + checker[:, :, None], 0, 255).astype(np.uint8)
+
+
+def encode(img):
+    return cv2.imencode(".png", img)[1].tobytes()  # lossless, so colours (and identities) survive
+
+
+def class_photo(students, variant = 0):
+    cols = int(np.ceil(np.sqrt(len(students))))
+    rows = int(np.ceil(len(students) / cols))
+    img = np.zeros((rows * CELL + 1, cols * CELL, 3), dtype = np.uint8)
+    for i, s in enumerate(students):
+        img[i // cols * CELL:(i // cols + 1) * CELL, i % cols * CELL:(i % cols + 1) * CELL] = face_tile(s)
+    img[-1, :3] = variant % 256, variant // 256 % 256, 1  # unique bytes per upload (dashboard dedupes by hash)
+    return encode(img)
+
+
+def install_stub(detect_ms, embed_ms):
+    module = types.ModuleType("deepface")
+    module.DeepFace = StubDeepFace(detect_ms, embed_ms)
+    sys.modules["deepface"] = module
+
+
+def load_service(filename, name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(BASE_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# --- LOAD DRIVER ---
+def summarize(latencies, errors, wall):
+    lat = np.asarray(latencies) * 1000
+    ok = len(lat) - errors
+    if not len(lat): return {"requests": 0}
+    return {"requests": len(lat), "errors": errors, "wall_s": round(wall, 3), "req_per_s": round(ok / wall, 2),
+            "mean_ms": round(float(lat.mean()), 2), "p50_ms": round(float(np.percentile(lat, 50)), 2),
+            "p95_ms": round(float(np.percentile(lat, 95)), 2), "p99_ms": round(float(np.percentile(lat, 99)), 2),
+            "max_ms": round(float(lat.max()), 2)}
+
+
+async def burst(n, concurrency, call):
+    """Fire n calls with at most `concurrency` in flight. call(i) returns True on success."""
+    sem = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                ok = await call(i)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - t0)
+            if not ok: errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return summarize(latencies, errors, time.perf_counter() - t0)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# --- SCENARIOS ---
+async def run(args):
+    gpu = load_service("2_gpu_server.py", "gpu_server")
+    dash = load_service("1_prof_dash.py", "prof_dash")
+    student_app = load_service("3_student_app.py", "student_app")
+    from sqlmodel import Session
+    from models import Professor, ClassRoom, Student
+
+    dash.ai_client.transport = httpx.ASGITransport(app = gpu.app)
+    student_app.prof_client.transport = httpx.ASGITransport(app = dash.app)
+    ai = httpx.AsyncClient(transport = httpx.ASGITransport(app = gpu.app), base_url = "http://ai", timeout = 600)
+    prof = httpx.AsyncClient(transport = httpx.ASGITransport(app = dash.app), base_url = "http://prof", timeout = 600)
+    stud = httpx.AsyncClient(transport = httpx.ASGITransport(app = student_app.app), base_url = "http://student",
+                             timeout = 600)
+    results = {}
+
+    async with gpu.app.router.lifespan_context(gpu.app), dash.app.router.lifespan_context(dash.app), \
+            student_app.app.router.lifespan_context(student_app.app):
+        # Synthetic classes: reference photo per student on disk + rows in SQLite
+        classes = []
+        with Session(dash.engine) as session:
+            p = Professor(username = "bench", password = "bench")
+            session.add(p)
+            session.commit()
+            for c in range(args.classes):
+                cls = ClassRoom(name = f"Bench{c}", batch = "2024", professor_id = p.id)
+                session.add(cls)
+                session.commit()
+                folder = os.path.join(dash.STUDENT_DB, f"{cls.name}_{cls.batch}")
+                students = []
+                for j in range(args.students):
+                    sid = c * args.students + j
+                    path = os.path.join(folder, f"stu_{sid}")
+                    os.makedirs(path, exist_ok = True)
+                    cv2.imwrite(os.path.join(path, "ref.png"), face_tile(sid))
+                    session.add(Student(roll_number = str(sid), name = f"Student {sid}", classroom_id = cls.id,
+                                        folder_path = path))
+                    students.append((sid, path))
+                session.commit()
+                classes.append((cls.id, folder, students))
+
+        while (await ai.get("/readyz")).status_code != 200:  # models warm up in the background
+            await asyncio.sleep(0.05)
+
+        t0 = time.perf_counter()
+        for _, folder, _ in classes:
+            (await ai.post("/enroll", data = {"class_folder_path": folder})).raise_for_status()
+        results["enroll"] = {"students": args.classes * args.students, "wall_s": round(time.perf_counter() - t0, 3)}
+
+        def pick(i):
+            class_id, folder, students = classes[i % len(classes)]
+            sid, path = students[i // len(classes) % len(students)]
+            return class_id, folder, sid, path
+
+        async def selfie(i):
+            _, _, sid, path = pick(i)
+            r = await ai.post("/verify-selfie", files = {"file": ("s.png", encode(face_tile(sid)), "image/png")},
+                              data = {"student_folder_path": path})
+            return r.json().get("match") is True
+
+        async def proxy(i):
+            class_id, _, sid, _ = pick(i)
+            r = await prof.post("/verify-student-proxy", files = {"file": ("s.png", encode(face_tile(sid)), "image/png")},
+                                data = {"class_id": class_id, "roll_number": str(sid)})
+            return r.json().get("match") is True
+
+        async def checkin(i):
+            class_id, _, sid, _ = pick(i)
+            r = await stud.post("/verify", files = {"file": ("s.png", encode(face_tile(sid)), "image/png")},
+                                data = {"class_id": str(class_id), "roll_number": str(sid)})
+            return r.json().get("match") is True
+
+        async def photo(i):
+            _, folder, students = classes[i % len(classes)]
+            r = await ai.post("/process-class-photo", data = {"class_folder_path": folder},
+                              files = {"file": ("c.png", class_photo([s for s, _ in students], i), "image/png")})
+            return len(r.json().get("found", [])) == len(students)
+
+        async def photo_job(i):
+            # Dashboard path: submit, then poll until the background job is done
+            class_id, _, students = classes[i % len(classes)]
+            r = await prof.post("/process-class-photo", data = {"class_id": class_id},
+                                files = {"file": ("c.png", class_photo([s for s, _ in students], 1000 + i), "image/png")})
+            job_id = r.headers["x-job-id"]
+            while True:
+                job = (await prof.get(f"/api/jobs/{job_id}")).json()
+                if job["status"] in ("done", "failed"): return job["status"] == "done"
+                await asyncio.sleep(0.02)
+
+        async def poll(i):
+            r = await prof.get(f"/api/live-attendance/{classes[i % len(classes)][0]}")
+            return r.status_code == 200
+
+        n, conc = args.requests, args.concurrency
+        results["verify_selfie"] = await burst(n, conc, selfie)
+        results["verify_student_proxy"] = await burst(n, conc, proxy)
+        results["student_checkin"] = await burst(n, conc, checkin)
+        results["process_class_photo"] = await burst(args.photos, args.photo_concurrency, photo)
+        results["class_photo_job"] = await burst(args.photos, args.photo_concurrency, photo_job)
+        results["live_attendance_poll"] = await burst(n, conc, poll)
+
+        # Check-in burst while every dashboard keeps polling, as during a real lecture
+        mixed = await asyncio.gather(burst(n, conc, proxy), burst(n * 2, conc, poll))
+        results["mixed_checkin"], results["mixed_poll"] = mixed
+
+        results["ai_scheduler"] = (await ai.get("/scheduler-metrics")).json()
+
+    for client in (ai, prof, stud): await client.aclose()
+    return results
+
+
+def compare(new, old):
+    print(f"{'scenario':<24}{'p95 old':>10}{'p95 new':>10}{'req/s old':>11}{'req/s new':>11}")
+    for name, cur in new["scenarios"].items():
+        prev = old.get("scenarios", {}).get(name, {})
+        if "p95_ms" not in cur or "p95_ms" not in prev: continue
+        print(f"{name:<24}{prev['p95_ms']:>10}{cur['p95_ms']:>10}{prev['req_per_s']:>11}{cur['req_per_s']:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Offline load test for the IR!S services (stub face model)")
+    parser.add_argument("--classes", type = int, default = 2)
+    parser.add_argument("--students", type = int, default = 60, help = "students per class")
+    parser.add_argument("--requests", type = int, default = 200, help = "requests per selfie/poll burst")
+    parser.add_argument("--concurrency", type = int, default = 32)
+    parser.add_argument("--photos", type = int, default = 8, help = "class photos per burst")
+    parser.add_argument("--photo-concurrency", type = int, default = 2)
+    parser.add_argument("--detect-ms", type = float, default = 5.0, help = "simulated detector cost per image")
+    parser.add_argument("--embed-ms", type = float, default = 2.0, help = "simulated model cost per face")
+    parser.add_argument("--out", default = f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument("--baseline", help = "earlier result file to compare against")
+    args = parser.parse_args()
+    if args.classes * args.students > 4096: parser.error("at most 4096 synthetic students")
+
+    workdir = tempfile.mkdtemp(prefix = "iris_bench_")
+    os.environ["IRIS_STUDENT_DB"] = os.path.join(workdir, "student_db")
+    os.environ["IRIS_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    install_stub(args.detect_ms, args.embed_ms)
+    os.chdir(BASE_DIR)  # templates/ is resolved relative to the working directory
+    sys.path.insert(0, BASE_DIR)
+
+    try:
+        scenarios = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors = True)
+
+    report = {"started_at": datetime.now().isoformat(timespec = "seconds"), "config": vars(args),
+              "peak_rss_mb": peak_rss_mb(), "scenarios": scenarios}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent = 2)
+    for name, r in scenarios.items():
+        if "p50_ms" in r:
+            print(f"{name:<24} {r['req_per_s']:>8} req/s  p50 {r['p50_ms']:>8} ms  p95 {r['p95_ms']:>8} ms  "
+                  f"p99 {r['p99_ms']:>8} ms  errors {r['errors']}")
+    print(f"Peak RSS: {report['peak_rss_mb']} MB. Saved to {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
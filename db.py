@@ -0,0 +1,47 @@
+from sqlalchemy import event, text
+from sqlmodel import create_engine
+
+# Bump when adding a step to MIGRATIONS; stored in the SQLite file as PRAGMA user_version
+SCHEMA_VERSION = 1
+
+MIGRATIONS = {
+    # 1: indexes for the attendance queries + one record per student/day/method.
+    #    Duplicates from older versions are dropped (oldest kept) before the unique index is built.
+    1: [
+        "DELETE FROM attendance WHERE id NOT IN "
+        "(SELECT MIN(id) FROM attendance GROUP BY student_id, date, method)",
+        "CREATE INDEX IF NOT EXISTS ix_student_class_roll ON student (classroom_id, roll_number)",
+        "CREATE INDEX IF NOT EXISTS ix_attendance_class_date ON attendance (classroom_id, date)",
+        "CREATE INDEX IF NOT EXISTS ix_attendance_student_date ON attendance (student_id, date)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_student_date_method "
+        "ON attendance (student_id, date, method)",
+    ],
+}
+
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets dashboard reads run while a selfie write commits; NORMAL sync is safe under WAL
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.close()
+
+
+def create_db_engine(url: str, **kwargs):
+    engine = create_engine(url, **kwargs)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _sqlite_pragmas)
+    return engine
+
+
+def migrate(engine):
+    """Bring an existing database up to SCHEMA_VERSION. Run after SQLModel.metadata.create_all()."""
+    if engine.dialect.name != "sqlite": return
+    with engine.begin() as conn:
+        version = conn.execute(text("PRAGMA user_version")).scalar()
+        for step in range(version + 1, SCHEMA_VERSION + 1):
+            for sql in MIGRATIONS[step]:
+                conn.execute(text(sql))
+            conn.execute(text(f"PRAGMA user_version={step}"))
+            print(f"Database migrated to schema version {step}")
@@ -0,0 +1,141 @@
+import os
+import time
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+
+from embedder import EMBED_BATCH_SIZE, extract_faces, face_to_bgr, embed_faces
+
+# --- DETECTION MODES ---
+# "full":  one detector call on the whole photo (previous behaviour)
+# "tiled": a fast pass on a downsampled copy for the big/near faces, then overlapping tiles at
+#          TILE_SCALE so small faces at the back of a hall are large enough to detect; the two
+#          passes are merged with NMS. Slower, better recall on high-megapixel photos.
+DETECTION_MODE = os.environ.get("IRIS_DETECTION_MODE", "full")
+COARSE_MAX_SIDE = int(os.environ.get("IRIS_COARSE_MAX_SIDE", 1600))
+TILE_SIZE = int(os.environ.get("IRIS_TILE_SIZE", 1024))  # tile side in pixels fed to the detector
+TILE_OVERLAP = float(os.environ.get("IRIS_TILE_OVERLAP", 0.25))  # must exceed the largest face we want from tiles
+TILE_SCALE = float(os.environ.get("IRIS_TILE_SCALE", 1.0))  # resize factor applied to the original for tiles
+TILE_WORKERS = int(os.environ.get("IRIS_TILE_WORKERS", min(4, os.cpu_count() or 1)))
+NMS_IOU = 0.4
+NMS_CONTAIN = 0.7  # intersection / smaller box: a tile-cut face inside the whole one is the same face
+
+# Long-lived so each tile thread keeps its own detector (see embedder.extract_faces)
+_tile_pool = ThreadPoolExecutor(max_workers = TILE_WORKERS, thread_name_prefix = "tile")
+
+
+def _detect(img, offset = (0, 0), scale = 1.0):
+    """Run the detector on img and map boxes back to original-photo coordinates."""
+    faces = extract_faces(img, enforce_detection = False)
+    h, w = img.shape[:2]
+    out = []
+    for f in faces:
+        a = f["facial_area"]
+        # With enforce_detection=False an image without faces comes back as one whole-image "face"
+        if a["x"] == 0 and a["y"] == 0 and a["w"] >= w - 1 and a["h"] >= h - 1: continue
+        if f["face"].size == 0: continue
+        box = {"x": int(offset[0] + a["x"] / scale), "y": int(offset[1] + a["y"] / scale),
+               "w": int(a["w"] / scale), "h": int(a["h"] / scale)}
+        out.append({"face": f["face"], "facial_area": box, "confidence": float(f.get("confidence", 0) or 0)})
+    return out
+
+
+def _overlap(a, b):
+    """(IoU, intersection over the smaller box) of two boxes."""
+    x1, y1 = max(a["x"], b["x"]), max(a["y"], b["y"])
+    x2, y2 = min(a["x"] + a["w"], b["x"] + b["w"]), min(a["y"] + a["h"], b["y"] + b["h"])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    area_a, area_b = a["w"] * a["h"], b["w"] * b["h"]
+    union = area_a + area_b - inter
+    smaller = min(area_a, area_b)
+    return (inter / union if union else 0.0), (inter / smaller if smaller else 0.0)
+
+
+def nms(faces, iou = NMS_IOU, contain = NMS_CONTAIN):
+    # Highest confidence first, then larger boxes (the coarse pass sees near faces whole). A box mostly
+    # inside another is the same face cut by a tile border; of the two, the larger (whole) one is kept.
+    area = lambda f: f["facial_area"]["w"] * f["facial_area"]["h"]
+    ranked = sorted(faces, key = lambda f: (f["confidence"], area(f)), reverse = True)
+    kept = []
+    for f in ranked:
+        for i, k in enumerate(kept):
+            overlap_iou, overlap_contain = _overlap(f["facial_area"], k["facial_area"])
+            if overlap_iou >= iou or overlap_contain >= contain:
+                if overlap_contain >= contain and area(f) > area(k): kept[i] = f
+                break
+        else:
+            kept.append(f)
+    return kept
+
+
+def tile_regions(width, height, scale = TILE_SCALE, size = TILE_SIZE, overlap = TILE_OVERLAP):
+    """Overlapping tiles covering the photo, in original-photo coordinates."""
+    side = max(1, int(size / scale))
+    step = max(1, int(side * (1 - overlap)))
+    xs = list(range(0, max(1, width - side) + 1, step))
+    ys = list(range(0, max(1, height - side) + 1, step))
+    if xs[-1] + side < width: xs.append(width - side)
+    if ys[-1] + side < height: ys.append(height - side)
+    return [{"x": max(0, x), "y": max(0, y), "w": min(side, width), "h": min(side, height)} for y in ys for x in xs]
+
+
+def _detect_tile(img, region, scale):
+    crop = img[region["y"]:region["y"] + region["h"], region["x"]:region["x"] + region["w"]]
+    if scale != 1.0:
+        crop = cv2.resize(crop, None, fx = scale, fy = scale,
+                          interpolation = cv2.INTER_CUBIC if scale > 1 else cv2.INTER_AREA)
+    return _detect(crop, (region["x"], region["y"]), scale)
+
+
+def detect_faces(img, mode = None):
+    """
+    Detect faces in a BGR photo. Returns (faces, report); faces carry "face" (aligned RGB crop),
+    "facial_area" (original-photo coordinates) and "confidence". The report lists the regions
+    searched and the time spent per stage.
+    """
+    mode = mode or DETECTION_MODE
+    height, width = img.shape[:2]
+    report = {"mode": mode, "image": {"w": width, "h": height}, "regions": [], "timings_ms": {}}
+
+    if mode != "tiled":
+        t0 = time.perf_counter()
+        faces = _detect(img)
+        report["regions"].append({"x": 0, "y": 0, "w": width, "h": height, "scale": 1.0, "pass": "full"})
+        report["timings_ms"]["detect"] = 1000 * (time.perf_counter() - t0)
+        report["detections"] = len(faces)
+        return faces, report
+
+    # Pass 1: downsampled copy
+    t0 = time.perf_counter()
+    coarse_scale = min(1.0, COARSE_MAX_SIDE / max(width, height))
+    small = cv2.resize(img, None, fx = coarse_scale, fy = coarse_scale,
+                       interpolation = cv2.INTER_AREA) if coarse_scale < 1 else img
+    faces = _detect(small, scale = coarse_scale)
+    report["regions"].append({"x": 0, "y": 0, "w": width, "h": height, "scale": coarse_scale, "pass": "coarse"})
+    t1 = time.perf_counter()
+
+    # Pass 2: overlapping tiles, in parallel
+    regions = tile_regions(width, height)
+    for found in _tile_pool.map(lambda r: _detect_tile(img, r, TILE_SCALE), regions):
+        faces.extend(found)
+    report["regions"].extend(dict(r, scale = TILE_SCALE, **{"pass": "tile"}) for r in regions)
+    t2 = time.perf_counter()
+
+    merged = nms(faces)
+    t3 = time.perf_counter()
+    report["timings_ms"].update({"coarse": 1000 * (t1 - t0), "tiles": 1000 * (t2 - t1), "nms": 1000 * (t3 - t2)})
+    report["detections"] = len(merged)
+    report["raw_detections"] = len(faces)
+    return merged, report
+
+
+def detect_and_embed(img, mode = None, batch_size = EMBED_BATCH_SIZE):
+    """
+    detect_faces, then all face crops embedded in batches. Returns (faces, report) with one
+    {"embedding", "facial_area", "confidence"} per face; the report gains an "embed" timing.
+    """
+    faces, report = detect_faces(img, mode)
+    t0 = time.perf_counter()
+    embs = embed_faces([face_to_bgr(f["face"]) for f in faces], batch_size)
+    report["timings_ms"]["embed"] = 1000 * (time.perf_counter() - t0)
+    return [{"embedding": emb, "facial_area": f["facial_area"], "confidence": f["confidence"]}
+            for f, emb in zip(faces, embs)], report
@@ -0,0 +1,144 @@
+import os
+import threading
+import numpy as np
+from imaging import as_array
+from workers import INTRA_OP_THREADS
+from backends import BACKENDS
+
+MODEL = "Facenet512"
+DETECTOR = "opencv"
+EMBED_BATCH_SIZE = int(os.environ.get("IRIS_EMBED_BATCH_SIZE", 32))
+
+# --- EMBEDDING BACKEND ---
+# "keras" runs DeepFace's Facenet512 as before; "onnx"/"tflite" run an exported (optionally float16 or
+# int8) copy from IRIS_EMBED_MODEL_PATH, see export_model.py. Embedding stores remember MODEL_ID and
+# are rebuilt when it changes, since different backends give slightly different vectors.
+EMBED_BACKEND = os.environ.get("IRIS_EMBED_BACKEND", "keras")
+EMBED_MODEL_PATH = os.environ.get("IRIS_EMBED_MODEL_PATH", "")
+MODEL_ID = f"keras:{MODEL}" if EMBED_BACKEND == "keras" else f"{EMBED_BACKEND}:{os.path.basename(EMBED_MODEL_PATH)}"
+
+_deepface = None
+_backend = None
+_import_lock = threading.Lock()
+_detect_lock = None  # only used if per-thread detectors could not be set up
+
+
+def deepface():
+    # DeepFace pulls in TensorFlow (seconds); importing on first use lets the server start and answer /healthz at once
+    global _deepface
+    if _deepface is None:
+        with _import_lock:
+            if _deepface is None:
+                from deepface import DeepFace
+                _per_thread_detectors()
+                _deepface = DeepFace
+    return _deepface
+
+
+# --- DETECTOR PER THREAD ---
+# DeepFace caches one detector per backend for the whole process, and OpenCV's cascade classifier
+# keeps per-call state, so concurrent detectMultiScale calls (tiles, selfies next to class photos,
+# enrollment) can return wrong or missing boxes. Every thread gets its own detector instead.
+class _PerThread:
+    def __init__(self, factory):
+        self.factory = factory
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        detector = getattr(self.local, "detector", None)
+        if detector is None:
+            detector = self.local.detector = self.factory()
+        return getattr(detector, name)
+
+
+def _per_thread_detectors():
+    global _detect_lock
+    try:
+        from deepface.modules import modeling
+        # "opencv" is also what DeepFace uses to find eyes for other backends
+        for name in {DETECTOR, "opencv"}:
+            modeling.build_model(task = "face_detector", model_name = name)  # creates the cache entry
+            modeling.cached_models["face_detector"][name] = _PerThread(
+                modeling.get_model_class(task = "face_detector", model_name = name))
+    except Exception as e:
+        print(f"Per-thread face detectors unavailable, detection runs one call at a time: {e}")
+        _detect_lock = threading.Lock()
+
+
+def extract_faces(img, **kwargs):
+    """deepface().extract_faces with the configured detector; the one entry point for detection."""
+    df = deepface()
+    if _detect_lock is None:
+        return df.extract_faces(img, detector_backend = DETECTOR, **kwargs)
+    with _detect_lock:
+        return df.extract_faces(img, detector_backend = DETECTOR, **kwargs)
+
+
+class KerasBackend:
+    def embed(self, crops):
+        res = deepface().represent(list(crops), model_name = MODEL, detector_backend = "skip", enforce_detection = False)
+        # represent() returns one list of faces per input image; with "skip" each has exactly one
+        return np.asarray([r[0]["embedding"] if isinstance(r, list) else r["embedding"] for r in res],
+                          dtype = np.float32)
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _import_lock:
+            if _backend is None:
+                if EMBED_BACKEND == "keras":
+                    _backend = KerasBackend()
+                else:
+                    _backend = BACKENDS[EMBED_BACKEND](EMBED_MODEL_PATH, INTRA_OP_THREADS)
+    return _backend
+
+
+def warmup(batch_sizes = (1,), detector = True):
+    """
+    Load the models and run them once at every batch size the server uses, so the first real
+    requests don't pay for model building/tracing. Raises if a model can't be loaded.
+    """
+    if detector:
+        extract_faces(np.full((480, 640, 3), 127, dtype = np.uint8), enforce_detection = False)
+    crop = np.full((160, 160, 3), 127, dtype = np.uint8)
+    backend = get_backend()
+    if hasattr(backend, "batch_sizes"): backend.batch_sizes = sorted(set(batch_sizes))  # fixed-shape runtimes (TFLite)
+    for size in sorted(set(batch_sizes)):
+        embed_faces([crop] * size, size)
+
+
+def face_to_bgr(face):
+    # extract_faces returns RGB floats in [0, 1]; the model path expects BGR uint8 like a loaded image
+    if face.max() <= 1: face = (face * 255).astype(np.uint8)
+    return np.ascontiguousarray(face[:, :, ::-1])
+
+
+def embed_faces(crops, batch_size = EMBED_BATCH_SIZE):
+    """
+    Embed already detected/aligned BGR face crops. Crops are stacked and sent through the
+    embedding backend in chunks of batch_size (one forward pass per chunk).
+    Returns a float32 array of shape (len(crops), dim).
+    """
+    if not crops: return np.zeros((0, 0), dtype = np.float32)
+    backend = get_backend()
+    return np.concatenate([backend.embed(crops[start:start + batch_size])
+                           for start in range(0, len(crops), batch_size)]).astype(np.float32, copy = False)
+
+
+def embed_largest_faces(images, enforce_detection = True, batch_size = EMBED_BATCH_SIZE):
+    """
+    Selfie path: detect per image, keep the largest face, then embed all kept crops together.
+    Returns one embedding per image, or the Exception raised for that image.
+    """
+    crops, slots = [], []
+    for img in images:
+        try:
+            faces = extract_faces(as_array(img), enforce_detection = enforce_detection)
+            face = max(faces, key = lambda f: f["facial_area"]["w"] * f["facial_area"]["h"])
+            crops.append(face_to_bgr(face["face"]))
+            slots.append(len(crops) - 1)
+        except Exception as e:
+            slots.append(e)
+    embs = embed_faces(crops, batch_size)
+    return [embs[s] if isinstance(s, int) else s for s in slots]
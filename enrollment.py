@@ -0,0 +1,77 @@
+import os
+import cv2
+import numpy as np
+
+from embedder import extract_faces, face_to_bgr, embed_faces
+from face_store import Rejected
+
+# --- QUALITY GATES ---
+# Reference photos are checked once at enrollment; anything below these is rejected with a reason
+# the professor sees on the management page, instead of silently becoming a bad reference.
+MAX_SIDE = int(os.environ.get("IRIS_ENROLL_MAX_SIDE", 1024))  # downscale before detection
+MIN_FACE_PX = int(os.environ.get("IRIS_ENROLL_MIN_FACE_PX", 80))  # face size in the original photo
+MIN_SHARPNESS = float(os.environ.get("IRIS_ENROLL_MIN_SHARPNESS", 40.0))  # variance of Laplacian on the crop
+MIN_CONFIDENCE = float(os.environ.get("IRIS_ENROLL_MIN_CONFIDENCE", 0.8))
+CROP_SIZE = 160  # Facenet input size; crops are stored at this size
+
+
+def sharpness(bgr):
+    return float(cv2.Laplacian(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY), cv2.CV_64F).var())
+
+
+def preprocess_photo(path):
+    """Decode, downscale, detect, align and quality-check one reference photo. Returns a BGR crop or Rejected."""
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return Rejected("Not a readable image")
+    scale = min(1.0, MAX_SIDE / max(img.shape[:2]))
+    if scale < 1.0:
+        img = cv2.resize(img, None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+
+    try:
+        faces = extract_faces(img, enforce_detection = True, align = True)
+    except ValueError:
+        return Rejected("No face found")
+
+    faces.sort(key = lambda f: f["facial_area"]["w"] * f["facial_area"]["h"], reverse = True)
+    face = faces[0]
+    area = face["facial_area"]
+    if len(faces) > 1:
+        second = faces[1]["facial_area"]
+        if second["w"] * second["h"] > 0.5 * area["w"] * area["h"]:
+            return Rejected("More than one face in the photo")
+    if min(area["w"], area["h"]) / scale < MIN_FACE_PX:
+        return Rejected(f"Face too small (under {MIN_FACE_PX}px)")
+    if face.get("confidence", 1.0) < MIN_CONFIDENCE:
+        return Rejected("Face not clearly visible")
+
+    crop = cv2.resize(face_to_bgr(face["face"]), (CROP_SIZE, CROP_SIZE), interpolation = cv2.INTER_AREA)
+    if sharpness(crop) < MIN_SHARPNESS:
+        return Rejected("Photo is too blurry")
+    return crop
+
+
+def enroll_paths(store, paths):
+    """
+    embed_fn for EmbeddingStore.refresh: runs the pipeline on each new/changed photo, caches the
+    aligned crop under the store's crops/ folder and embeds all accepted crops in one batched pass.
+    """
+    crops, slots = [], []
+    for path in paths:
+        stu, img = os.path.basename(os.path.dirname(path)), os.path.basename(path)
+        try:
+            res = preprocess_photo(path)
+        except Exception as e:
+            print(f"Could not preprocess {path}: {e}")
+            res = None
+        if isinstance(res, np.ndarray):
+            crop_path = store.crop_path(stu, img)
+            os.makedirs(os.path.dirname(crop_path), exist_ok = True)
+            cv2.imwrite(crop_path, res)
+            slots.append(len(crops))
+            crops.append(res)
+        else:
+            slots.append(res)
+
+    embs = embed_faces(crops) if crops else []
+    return [embs[s] if isinstance(s, int) else s for s in slots]
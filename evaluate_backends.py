@@ -0,0 +1,138 @@
+"""
+Accuracy versus speed of the embedding backends and gallery precisions on a held-out set.
+
+    python evaluate_backends.py --backends keras onnx=models/facenet512_int8.onnx tflite=models/facenet512_fp16.tflite
+    python evaluate_backends.py --data heldout/ --align --out backends.json
+
+The held-out set is a folder with one subfolder per person (default: the aligned crops the
+enrollment pipeline stored under student_db). Per person the first image is the gallery
+reference and the rest are probes, the same shape as a selfie check against enrollment photos.
+
+For every backend and gallery dtype it reports ms/face at batch 1 and EMBED_BATCH_SIZE, agreement
+with the Keras embeddings, rank-1 accuracy, TAR/FAR over a sweep of cosine distance thresholds,
+and the largest threshold whose FAR stays under --far; use that for IRIS_SELFIE_THRESHOLD /
+IRIS_CLASS_PHOTO_THRESHOLD when deploying with that IRIS_EMBED_BACKEND and IRIS_GALLERY_DTYPE.
+"""
+import os
+import glob
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+
+from workers import INTRA_OP_THREADS  # sets TF thread limits, must come before anything importing deepface
+from embedder import EMBED_BATCH_SIZE, KerasBackend
+from backends import BACKENDS
+from face_store import STORE_DIR, CROP_DIR, IMAGE_EXTS, normalize, quantize, dequantize, student_scores
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GALLERY_DTYPES = ("float32", "float16", "int8")
+THRESHOLDS = [round(float(t), 2) for t in np.arange(0.20, 0.75, 0.05)]
+LATENCY_FACES = 64  # faces timed one at a time
+
+
+def load_set(folder, align = False):
+    """[(identity, crop)] from <folder>/<identity>/<image>, or from the enrollment crops if folder is None."""
+    if folder is None:
+        student_db = os.environ.get("IRIS_STUDENT_DB", os.path.join(BASE_DIR, "student_db"))
+        paths = glob.glob(os.path.join(student_db, "*", STORE_DIR, CROP_DIR, "*", "*.png"))
+        ident = lambda p: os.path.relpath(p, student_db).split(os.sep)[0] + "/" + os.path.basename(os.path.dirname(p))
+    else:
+        paths = [p for p in glob.glob(os.path.join(folder, "*", "*")) if p.lower().endswith(IMAGE_EXTS)]
+        ident = lambda p: os.path.basename(os.path.dirname(p))
+
+    if align:
+        from enrollment import preprocess_photo
+
+    samples = []
+    for path in sorted(paths):
+        crop = preprocess_photo(path) if align else cv2.imread(path)
+        if isinstance(crop, np.ndarray): samples.append((ident(path), crop))
+    return samples
+
+
+def make_backend(spec):
+    name, _, path = spec.partition("=")
+    return KerasBackend() if name == "keras" else BACKENDS[name](path, INTRA_OP_THREADS)
+
+
+def embed_timed(backend, crops):
+    """Embeddings of all crops plus ms/face at batch size 1 and EMBED_BATCH_SIZE (after one warm-up call)."""
+    backend.embed(crops[:1])
+    t0 = time.perf_counter()
+    parts = [backend.embed(crops[i:i + EMBED_BATCH_SIZE]) for i in range(0, len(crops), EMBED_BATCH_SIZE)]
+    batched = (time.perf_counter() - t0) / len(crops)
+    single = crops[:LATENCY_FACES]
+    t0 = time.perf_counter()
+    for crop in single:
+        backend.embed([crop])
+    return np.concatenate(parts), {"batch_1": 1000 * (time.perf_counter() - t0) / len(single),
+                                   f"batch_{EMBED_BATCH_SIZE}": 1000 * batched}
+
+
+def verification(labels, embs, gallery_dtype, far_target):
+    """Gallery = first image per identity (stored at gallery_dtype), probes = the rest."""
+    first = {}
+    for i, label in enumerate(labels): first.setdefault(label, i)
+    ref_rows = sorted(first.values())
+    probe_rows = sorted(set(range(len(labels))) - set(ref_rows))
+    codes, scales = quantize(normalize(embs[ref_rows]), gallery_dtype)
+    gallery = dequantize(codes, scales)
+    students, sims = student_scores(embs[probe_rows], gallery, [labels[i] for i in ref_rows])
+
+    own = np.array([students.index(labels[i]) for i in probe_rows])
+    dist = 1.0 - sims
+    genuine = dist[np.arange(len(own)), own]
+    impostor = np.delete(dist, own + np.arange(len(own)) * dist.shape[1])  # every other identity
+    sweep = [{"threshold": t, "tar": float(np.mean(genuine < t)), "far": float(np.mean(impostor < t))}
+             for t in THRESHOLDS]
+    ok = [s for s in sweep if s["far"] <= far_target]
+    size = codes.nbytes + (scales.nbytes if scales is not None else 0)
+    return {"gallery_dtype": gallery_dtype, "gallery_bytes_per_face": size / len(ref_rows), "probes": len(probe_rows),
+            "rank1": float(np.mean(sims.argmax(axis = 1) == own)), "suggested_threshold": ok[-1] if ok else None, "sweep": sweep}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Compare embedding backends and gallery precisions on a held-out set")
+    parser.add_argument("--backends", nargs = "+", default = ["keras"],
+                        help = "keras, onnx=<path> or tflite=<path>; list keras first to measure agreement")
+    parser.add_argument("--gallery-dtypes", nargs = "+", default = list(GALLERY_DTYPES), choices = GALLERY_DTYPES)
+    parser.add_argument("--data", help = "folder with one subfolder of images per person (default: enrollment crops)")
+    parser.add_argument("--align", action = "store_true", help = "run the enrollment detector/aligner on --data images first")
+    parser.add_argument("--far", type = float, default = 0.001, help = "false accept rate the suggested threshold must meet")
+    parser.add_argument("--out", default = "backend_report.json")
+    args = parser.parse_args()
+
+    samples = load_set(args.data, args.align)
+    labels = [label for label, _ in samples]
+    crops = [crop for _, crop in samples]
+    if len(set(labels)) < 2 or len(labels) == len(set(labels)):
+        raise SystemExit("Need at least two people and someone with more than one image")
+    print(f"{len(crops)} faces, {len(set(labels))} people")
+
+    results, reference = [], None
+    for spec in args.backends:
+        embs, latency = embed_timed(make_backend(spec), crops)
+        embs = normalize(embs)
+        if spec == "keras": reference = embs
+        agreement = float(np.mean(np.sum(embs * reference, axis = 1))) if reference is not None else None
+        for dtype in args.gallery_dtypes:
+            results.append(dict(backend = spec, ms_per_face = latency, keras_agreement = agreement,
+                                **verification(labels, embs, dtype, args.far)))
+
+    print(f"{'backend':<40} {'gallery':<8} {'ms b=1':>7} {'ms b=' + str(EMBED_BATCH_SIZE):>7} {'cos':>6} "
+          f"{'rank1':>6} {'thresh':>6} {'TAR':>6} {'FAR':>7}")
+    for r in results:
+        best = r["suggested_threshold"] or {"threshold": float("nan"), "tar": float("nan"), "far": float("nan")}
+        cos = r["keras_agreement"] if r["keras_agreement"] is not None else float("nan")
+        print(f"{r['backend'][:40]:<40} {r['gallery_dtype']:<8} {r['ms_per_face']['batch_1']:>7.2f} "
+              f"{r['ms_per_face'][f'batch_{EMBED_BATCH_SIZE}']:>7.2f} {cos:>6.3f} {r['rank1']:>6.3f} "
+              f"{best['threshold']:>6.2f} {best['tar']:>6.3f} {best['far']:>7.4f}")
+    with open(args.out, "w") as f:
+        json.dump({"faces": len(crops), "people": len(set(labels)), "far_target": args.far, "results": results}, f, indent = 2)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
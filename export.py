@@ -0,0 +1,86 @@
+import io
+import csv
+from sqlmodel import Session
+from attendance import iter_summary, session_days
+
+# Streaming report writers: rows come from a server-side cursor and leave as encoded chunks,
+# so memory stays flat no matter how many days/classes are exported and nothing touches disk.
+REPORT_COLUMNS = ["Date", "Class", "Roll", "Name", "Status", "Method", "Verification"]
+EXPORT_FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+
+def iter_report_rows(engine, classes, start: str, end: str):
+    """classes = [(class_id, label)]. Yields one row per student per day the class met."""
+    with Session(engine) as session:
+        for class_id, label in classes:
+            for day in session_days(session, class_id, start, end):
+                for row in iter_summary(session, class_id, day):
+                    status, check = row.report()
+                    yield [day, label, row.roll, row.name, status, row.classify()[1], check]
+
+
+def stream_csv(rows, header, chunk_rows = 500):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % chunk_rows == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    # File-like target for pyarrow that hands written bytes back to the generator instead of a file
+    def __init__(self):
+        self.chunks = []
+        self.pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.pos
+
+    def drain(self):
+        out = b"".join(self.chunks)
+        self.chunks = []
+        return out
+
+
+def stream_parquet(rows, header, chunk_rows = 10000):
+    # Optional dependency, only needed when a Parquet export is requested
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    schema = pa.schema([(name, pa.string()) for name in header])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    batch = []
+    
+    def flush():
+        writer.write_table(pa.Table.from_pylist([dict(zip(header, r)) for r in batch], schema = schema))
+        batch.clear()
+        return sink.drain()
+    
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_rows:
+            yield flush()
+    if batch:
+        yield flush()
+    writer.close()
+    yield sink.drain()
+
+
+def stream_report(rows, header, fmt = "csv"):
+    if fmt == "parquet":
+        return stream_parquet(rows, header)
+    return stream_csv(rows, header)
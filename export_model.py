@@ -0,0 +1,99 @@
+"""
+Export the Facenet512 model for the reduced-precision embedding backends (see backends.py).
+
+    python export_model.py --format onnx-int8 --out models/facenet512_int8.onnx
+    python export_model.py --format tflite-int8 --out models/facenet512_int8.tflite
+
+then start the AI server with IRIS_EMBED_BACKEND=onnx (or tflite) and IRIS_EMBED_MODEL_PATH=<out>.
+Check accuracy and thresholds with evaluate_backends.py before switching a deployment over.
+
+Needs TensorFlow plus tf2onnx (ONNX), onnxruntime (onnx-int8) or onnxconverter-common (onnx-fp16).
+Static int8 TFLite calibrates on enrollment crops already in student_db.
+"""
+import os
+import glob
+import argparse
+import cv2
+
+from embedder import MODEL, deepface
+from face_store import STORE_DIR, CROP_DIR
+from backends import INPUT_SIZE, preprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FORMATS = ("onnx", "onnx-fp16", "onnx-int8", "tflite-fp16", "tflite-int8")
+
+
+def keras_model():
+    model = deepface().build_model(MODEL)
+    return getattr(model, "model", model)  # newer DeepFace wraps the Keras model in a client class
+
+
+def calibration_crops(student_db, limit = 200):
+    """Aligned face crops written by the enrollment pipeline, for int8 calibration."""
+    paths = sorted(glob.glob(os.path.join(student_db, "*", STORE_DIR, CROP_DIR, "*", "*.png")))[:limit]
+    crops = [cv2.imread(p) for p in paths]
+    return [c for c in crops if c is not None]
+
+
+def export_onnx(model, out, precision):
+    # Optional dependency, only needed for ONNX exports
+    import tf2onnx
+    import tensorflow as tf
+
+    spec = (tf.TensorSpec((None, INPUT_SIZE, INPUT_SIZE, 3), tf.float32, name = "input"),)
+    if precision == "fp32":
+        tf2onnx.convert.from_keras(model, input_signature = spec, opset = 13, output_path = out)
+        return
+    tmp = out + ".fp32.onnx"
+    tf2onnx.convert.from_keras(model, input_signature = spec, opset = 13, output_path = tmp)
+    try:
+        if precision == "int8":
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(tmp, out, weight_type = QuantType.QInt8)
+        else:
+            import onnx
+            from onnxconverter_common import float16
+            onnx.save(float16.convert_float_to_float16(onnx.load(tmp)), out)
+    finally:
+        os.remove(tmp)
+
+
+def export_tflite(model, out, precision, student_db):
+    # Optional dependency, only needed for TFLite exports
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if precision == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        crops = calibration_crops(student_db)
+        if not crops:
+            raise SystemExit(f"No enrollment crops under {student_db} to calibrate int8 with")
+        converter.representative_dataset = lambda: ([preprocess([c])] for c in crops)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        print(f"Calibrating on {len(crops)} enrollment crops")
+    with open(out, "wb") as f:
+        f.write(converter.convert())
+
+
+def main():
+    parser = argparse.ArgumentParser(description = f"Export {MODEL} as ONNX or TFLite")
+    parser.add_argument("--format", choices = FORMATS, required = True)
+    parser.add_argument("--out", required = True)
+    parser.add_argument("--student-db", default = os.environ.get("IRIS_STUDENT_DB", os.path.join(BASE_DIR, "student_db")),
+                        help = "enrollment crops used for int8 calibration")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok = True)
+    runtime, _, precision = args.format.partition("-")
+    model = keras_model()
+    if runtime == "onnx":
+        export_onnx(model, args.out, precision or "fp32")
+    else:
+        export_tflite(model, args.out, precision, args.student_db)
+    print(f"Wrote {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import os
+import json
+import threading
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from embedder import MODEL, MODEL_ID
+
+# Each class folder (student_db/<class>) gets a hidden ".embeddings" folder holding:
+#   gallery.npy -> matrix with one L2-normalized embedding per reference photo, stored as
+#                  GALLERY_DTYPE (int8 rows come with a scale each in gallery_scale.npy)
+#   index.json  -> one entry per matrix row: {"student", "image", "mtime", "size"},
+#                  plus photos the enrollment pipeline rejected and why, and the model that embedded them
+#   crops/      -> aligned face crops written by the enrollment pipeline
+STORE_DIR = ".embeddings"
+GALLERY_FILE = "gallery.npy"
+SCALE_FILE = "gallery_scale.npy"
+INDEX_FILE = "index.json"
+CROP_DIR = "crops"
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+STORE_VERSION = 2  # bump when the way embeddings are produced changes; older stores are rebuilt
+GALLERY_DTYPE = os.environ.get("IRIS_GALLERY_DTYPE", "float32")  # "float32", "float16" or "int8"
+
+
+class Rejected:
+    """Returned by an embed_fn for a photo that must not be used as a reference (bad quality, no face)."""
+
+    def __init__(self, reason):
+        self.reason = reason
+
+
+def normalize(vectors):
+    mat = np.asarray(vectors, dtype = np.float32)
+    if mat.ndim == 1: mat = mat[None, :]
+    norms = np.linalg.norm(mat, axis = 1, keepdims = True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def quantize(mat, dtype = GALLERY_DTYPE):
+    """float32 rows -> (codes, scales). int8 uses one symmetric scale per row; other dtypes have no scales."""
+    mat = np.asarray(mat, dtype = np.float32)
+    if dtype != "int8":
+        return mat.astype(dtype, copy = False), None
+    scales = np.abs(mat).max(axis = 1) / 127.0 if len(mat) else np.zeros(0, dtype = np.float32)
+    scales[scales == 0] = 1.0
+    return np.round(mat / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def dequantize(codes, scales = None):
+    if scales is None:
+        return codes.astype(np.float32, copy = False)
+    return codes.astype(np.float32) * scales[:, None]
+
+
+class Gallery:
+    """
+    Immutable snapshot of a store: entries and their embeddings as stored (codes, plus scales for
+    int8). Readers take one snapshot and use only it, so rows and labels always line up.
+    """
+
+    def __init__(self, entries = (), codes = None, scales = None):
+        self.entries = list(entries)
+        self.codes = codes if codes is not None else np.zeros((0, 0), dtype = np.float32)
+        self.scales = scales
+
+    @classmethod
+    def from_matrix(cls, entries, mat):
+        return cls(entries, *quantize(mat))
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def matrix(self):
+        """The gallery as float32, one row per entry (dequantized if stored as float16/int8)."""
+        return dequantize(self.codes, self.scales)
+
+    def rows(self, idx):
+        """float32 rows for the given row indices, without dequantizing the whole gallery."""
+        return dequantize(self.codes[idx], None if self.scales is None else self.scales[idx])
+
+    def labels(self):
+        return [e["student"] for e in self.entries]
+
+    def student_matrix(self, student):
+        return self.rows([i for i, e in enumerate(self.entries) if e["student"] == student])
+
+
+class EmbeddingStore:
+    def __init__(self, class_folder_path):
+        self.root = class_folder_path
+        self.dir = os.path.join(class_folder_path, STORE_DIR)
+        self.gallery = Gallery()  # replaced as a whole under self.lock, never modified in place
+        self.rejected = {}  # "stu/image" -> {"reason", "mtime", "size"}
+        self.lock = threading.Lock()
+        self._load()
+
+    @property
+    def entries(self):
+        return self.gallery.entries
+
+    # --- PERSISTENCE ---
+    def _load(self):
+        index_path = os.path.join(self.dir, INDEX_FILE)
+        gallery_path = os.path.join(self.dir, GALLERY_FILE)
+        if not (os.path.exists(index_path) and os.path.exists(gallery_path)):
+            return
+        try:
+            with open(index_path, "r") as f:
+                index = json.load(f)
+            if index.get("version") != STORE_VERSION: return
+            if index.get("model", f"keras:{MODEL}") != MODEL_ID: return  # other backend: re-embed everything
+            codes = np.load(gallery_path)
+            scales = np.load(os.path.join(self.dir, SCALE_FILE)) if codes.dtype == np.int8 else None
+            if len(index["entries"]) == len(codes):
+                gallery = Gallery(index["entries"], codes, scales)
+                if codes.dtype != np.dtype(GALLERY_DTYPE):  # convert to the configured dtype
+                    gallery = Gallery.from_matrix(gallery.entries, gallery.matrix)
+                self.gallery = gallery
+                self.rejected = index.get("rejected", {})
+        except Exception as e:
+            # A broken store is just rebuilt on the next refresh
+            print(f"Embedding store unreadable ({self.dir}): {e}")
+
+    def _save(self):
+        os.makedirs(self.dir, exist_ok = True)
+        gallery_path = os.path.join(self.dir, GALLERY_FILE)
+        index_path = os.path.join(self.dir, INDEX_FILE)
+        gallery = self.gallery
+        # Write-then-rename so a reader never sees a half written store
+        with open(gallery_path + ".tmp", "wb") as f:
+            np.save(f, gallery.codes)
+        if gallery.scales is not None:
+            scale_path = os.path.join(self.dir, SCALE_FILE)
+            with open(scale_path + ".tmp", "wb") as f:
+                np.save(f, gallery.scales)
+            os.replace(scale_path + ".tmp", scale_path)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump({"version": STORE_VERSION, "model": MODEL_ID, "entries": gallery.entries,
+                       "rejected": self.rejected}, f)
+        os.replace(gallery_path + ".tmp", gallery_path)
+        os.replace(index_path + ".tmp", index_path)
+
+    # --- DISK SCAN ---
+    def students_on_disk(self):
+        if not os.path.isdir(self.root): return []
+        return [d for d in os.listdir(self.root)
+                if not d.startswith(".") and os.path.isdir(os.path.join(self.root, d))]
+
+    def scan(self, students = None):
+        """Return {(student, image): (mtime, size)} for reference photos currently on disk."""
+        found = {}
+        for stu in (students if students is not None else self.students_on_disk()):
+            path = os.path.join(self.root, stu)
+            if not os.path.isdir(path): continue
+            for img in os.listdir(path):
+                if not img.lower().endswith(IMAGE_EXTS): continue
+                st = os.stat(os.path.join(path, img))
+                found[(stu, img)] = (st.st_mtime, st.st_size)
+        return found
+
+    def _reconcile(self, on_disk, students):
+        """
+        Compare a scan with the current snapshot (call under self.lock). Returns (rejected,
+        keep_rows, keep_entries, removed, pending), pending being the photos that need embedding.
+        """
+        in_scope = set(students) if students is not None else None
+        pending = dict(on_disk)
+
+        rejected = {}
+        for name, r in self.rejected.items():
+            key = tuple(name.split("/", 1))
+            if in_scope is not None and key[0] not in in_scope:
+                rejected[name] = r
+            elif pending.get(key) == (r["mtime"], r["size"]):
+                rejected[name] = r
+                del pending[key]
+
+        keep_rows, keep_entries, removed = [], [], []
+        for row, e in enumerate(self.gallery.entries):
+            key = (e["student"], e["image"])
+            if in_scope is not None and e["student"] not in in_scope:
+                keep_rows.append(row)
+                keep_entries.append(e)
+            elif pending.get(key) == (e["mtime"], e["size"]):
+                keep_rows.append(row)
+                keep_entries.append(e)
+                del pending[key]
+            else:
+                removed.append(key)
+        return rejected, keep_rows, keep_entries, removed, pending
+
+    def refresh(self, embed_fn, students = None, on_change = None):
+        """
+        Bring the store in line with the photos on disk. Only photos that are new or whose
+        mtime/size changed are passed to embed_fn(paths) -> list of vectors, None (failed,
+        retried next time) or Rejected (remembered until the file changes).
+        on_change(gallery, added, removed) runs under the store lock, so updates reach it in order.
+        Returns (added, removed, gallery): lists of (student, image) keys and the resulting snapshot.
+        """
+        # embed_fn runs without the lock, so enrolling a whole class doesn't hold up selfie lookups
+        # on it; results are merged into whatever the store holds by then
+        with self.lock:
+            pending = self._reconcile(self.scan(students), students)[-1]
+        results = {}
+        if pending:
+            keys = sorted(pending)
+            vecs = embed_fn([os.path.join(self.root, stu, img) for stu, img in keys])
+            results = {key: (pending[key], vec) for key, vec in zip(keys, vecs)}
+
+        with self.lock:
+            gallery = self.gallery
+            rejected, keep_rows, keep_entries, removed, pending = self._reconcile(self.scan(students), students)
+            rejections_changed = rejected.keys() != self.rejected.keys()
+
+            added, new_vecs = [], []
+            for key in sorted(pending):
+                stat, vec = results.get(key, (None, None))
+                # Not embedded above, or the file changed while it was: left for the next refresh
+                if vec is None or stat != pending[key]: continue
+                mtime, size = stat
+                if isinstance(vec, Rejected):
+                    rejected[f"{key[0]}/{key[1]}"] = {"reason": vec.reason, "mtime": mtime, "size": size}
+                    rejections_changed = True
+                    continue
+                keep_entries.append({"student": key[0], "image": key[1], "mtime": mtime, "size": size})
+                new_vecs.append(normalize(vec)[0])
+                added.append(key)
+
+            self.rejected = rejected
+            if not added and not removed:
+                if rejections_changed: self._save()
+                return added, removed, gallery
+
+            parts = [gallery.rows(keep_rows)] if keep_rows else []
+            if new_vecs: parts.append(np.stack(new_vecs))
+            matrix = np.concatenate(parts).astype(np.float32) if parts else np.zeros((0, 0), dtype = np.float32)
+            self.gallery = gallery = Gallery.from_matrix(keep_entries, matrix)
+            self._save()
+            if on_change: on_change(gallery, added, removed)
+            return added, removed, gallery
+
+    # --- LOOKUPS ---
+    def student_matrix(self, student):
+        return self.gallery.student_matrix(student)
+
+    def labels(self):
+        return self.gallery.labels()
+
+    def crop_path(self, student, image):
+        return os.path.join(self.dir, CROP_DIR, student, os.path.splitext(image)[0] + ".png")
+
+    def report(self):
+        """Per student: how many reference photos are in use and which were rejected (with reasons)."""
+        out = {}
+        for e in self.gallery.entries:
+            out.setdefault(e["student"], {"accepted": 0, "rejected": []})["accepted"] += 1
+        for name, r in sorted(self.rejected.items()):
+            stu, img = name.split("/", 1)
+            out.setdefault(stu, {"accepted": 0, "rejected": []})["rejected"].append({"image": img, "reason": r["reason"]})
+        return out
+
+
+# --- MATCHING ---
+def student_scores(face_vecs, gallery, labels):
+    """
+    Score every face against every student in one matrix multiply.
+    Returns (students, sims) where sims[i, j] is the best cosine similarity between
+    face i and any reference photo of students[j].
+    """
+    students, cols = np.unique(np.asarray(labels), return_inverse = True)
+    per_photo = normalize(face_vecs) @ gallery.T  # (faces, photos)
+    sims = np.full((per_photo.shape[0], len(students)), -1.0, dtype = np.float32)
+    np.maximum.at(sims.T, cols, per_photo.T)
+    return [str(s) for s in students], sims
+
+
+def assign_unique(sims, max_distance):
+    """
+    One-to-one face/student assignment (Hungarian) on cosine distance, so a student can't
+    be matched to two faces. Pairs at or above max_distance are never assigned.
+    Returns a list of (face_index, student_index, distance).
+    """
+    if sims.size == 0: return []
+    dist = 1.0 - sims
+    cost = np.where(dist < max_distance, dist, max_distance + 1.0)
+    rows, cols = linear_sum_assignment(cost)
+    return [(int(r), int(c), float(dist[r, c])) for r, c in zip(rows, cols) if dist[r, c] < max_distance]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(class_folder_path):
+    key = os.path.abspath(class_folder_path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = EmbeddingStore(key)
+        return _stores[key]
@@ -0,0 +1,59 @@
+import asyncio
+import random
+import httpx
+
+# Status codes worth another try: the other service is restarting or overloaded
+RETRY_STATUSES = {502, 503, 504}
+
+
+class ServiceClient:
+    """
+    Shared keep-alive client for calls between our services. One instance per target service,
+    opened/closed in the app's lifespan. Requests are capped at max_concurrency in flight and
+    retried with exponential backoff on connection errors and 502/503/504.
+    Bodies must be replayable (bytes, not open streams) for retries to resend them.
+    transport can be set before start() to route calls elsewhere (e.g. httpx.ASGITransport in benchmark.py).
+    """
+
+    def __init__(self, base_url, timeout = 30.0, connect_timeout = 5.0, retries = 2, backoff = 0.25,
+                 max_concurrency = 32, max_connections = 64):
+        self.base_url = base_url
+        self.timeout = httpx.Timeout(timeout, connect = connect_timeout)
+        self.limits = httpx.Limits(max_connections = max_connections, max_keepalive_connections = max_connections)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self.semaphore = None
+        self.client = None
+        self.transport = None
+
+    async def start(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.client = httpx.AsyncClient(base_url = self.base_url, timeout = self.timeout, limits = self.limits,
+                                        transport = self.transport)
+
+    async def close(self):
+        if self.client:
+            await self.client.aclose()
+        self.client = None
+
+    async def request(self, method, path, timeout = None, **kwargs):
+        if timeout is not None:
+            kwargs["timeout"] = httpx.Timeout(timeout, connect = self.timeout.connect)
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    resp = await self.client.request(method, path, **kwargs)
+                if resp.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return resp
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError):
+                if attempt >= self.retries: raise
+            attempt += 1
+            await asyncio.sleep(self.backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
@@ -0,0 +1,17 @@
+import cv2
+import numpy as np
+
+
+def decode_image(data):
+    """Decode encoded image bytes (JPEG/PNG/...) straight to a BGR uint8 array, no temp file."""
+    img = cv2.imdecode(np.frombuffer(data, dtype = np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Uploaded file is not a readable image")
+    return img
+
+
+def as_array(img):
+    # Model helpers accept raw upload bytes, a BGR array or a path; bytes are decoded in the worker
+    if isinstance(img, (bytes, bytearray, memoryview)):
+        return decode_image(img)
+    return img
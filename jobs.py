@@ -0,0 +1,116 @@
+import os
+import json
+import asyncio
+import hashlib
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from models import PhotoJob
+
+PHOTO_JOB_WORKERS = int(os.environ.get("IRIS_PHOTO_JOB_WORKERS", 2))  # class photos processed at once
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class PhotoJobQueue:
+    """
+    Class-photo jobs persisted in SQLite and run by a fixed number of asyncio workers.
+
+    handler(job, progress) does the work: it may call progress(stage, fraction) as it goes and
+    returns a JSON-serialisable result. Jobs still queued or running when the process stopped
+    are picked up again by start().
+    """
+
+    def __init__(self, engine, handler, workers = PHOTO_JOB_WORKERS):
+        self.engine = engine
+        self.handler = handler
+        self.workers = workers
+        self.queue = None
+        self.tasks = []
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        with Session(self.engine) as session:
+            pending = session.exec(select(PhotoJob.id).where(PhotoJob.status.in_(["queued", "running"]))
+                                   .order_by(PhotoJob.id)).all()
+        for job_id in pending:
+            self.queue.put_nowait(job_id)
+        if pending: print(f"Resuming {len(pending)} class photo job(s)")
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Interrupted jobs stay "running" in the database and are resumed by the next start()
+        for task in self.tasks: task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions = True)
+        self.tasks = []
+
+    def submit(self, session: Session, classroom_id: int, filename: str, data: bytes):
+        """
+        Queue a photo. Returns (job, created): the same bytes for the same class return the
+        existing job instead of being processed again; a failed job is re-queued.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        query = select(PhotoJob).where(PhotoJob.classroom_id == classroom_id, PhotoJob.content_hash == digest)
+        job = session.exec(query).first()
+        if job and job.status != "failed":
+            return job, False
+
+        now = _now()
+        job = job or PhotoJob(classroom_id = classroom_id, content_hash = digest, filename = filename, created_at = now)
+        job.image, job.status, job.stage, job.progress, job.error = data, "queued", "Waiting in queue", 0.0, None
+        job.updated_at = now
+        session.add(job)
+        try:
+            session.commit()
+        except IntegrityError:
+            # Same photo submitted twice at the same moment; the other request's job wins
+            session.rollback()
+            return session.exec(query).one(), False
+        session.refresh(job)
+        self.queue.put_nowait(job.id)
+        return job, True
+
+    def _update(self, job_id, **fields):
+        with Session(self.engine) as session:
+            job = session.get(PhotoJob, job_id)
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.updated_at = _now()
+            session.add(job)
+            session.commit()
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Job Error: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job_id):
+        with Session(self.engine, expire_on_commit = False) as session:
+            job = session.get(PhotoJob, job_id)
+            if not job or job.status not in ("queued", "running"): return
+            job.status, job.stage, job.updated_at = "running", "Starting", _now()
+            session.add(job)
+            session.commit()
+
+        def progress(stage, fraction):
+            self._update(job_id, stage = stage, progress = fraction)
+
+        try:
+            result = await self.handler(job, progress)
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._update(job_id, status = "failed", stage = "Failed", error = str(e), image = None)
+            return
+        self._update(job_id, status = "done", stage = "Done", progress = 1.0, result = json.dumps(result), image = None)
+
+
+def job_status(job: PhotoJob):
+    return {"id": job.id, "class_id": job.classroom_id, "status": job.status, "stage": job.stage,
+            "progress": job.progress, "error": job.error, "created_at": job.created_at, "updated_at": job.updated_at}
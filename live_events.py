@@ -0,0 +1,85 @@
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+
+
+class AttendanceBroker:
+    """
+    In-process pub/sub for live attendance deltas, one channel per class.
+
+    Every published event gets a cursor "<epoch>-<seq>". A client that reconnects with its last
+    cursor (SSE Last-Event-ID) is replayed whatever it missed from a per-class history buffer.
+    If the cursor is from an older process (epoch changed) or older than the buffer, the client
+    gets a "reset" event and should reload the full list once.
+    """
+
+    def __init__(self, history = 1000):
+        self.epoch = str(int(time.time()))
+        self.seq = 0
+        self.history_size = history
+        self.history = {}  # class_id -> deque[(seq, payload)]
+        self.trimmed = {}  # class_id -> highest seq dropped from history
+        self.subscribers = {}  # class_id -> set[(loop, queue)]
+        self.lock = threading.Lock()
+
+    def cursor(self):
+        return f"{self.epoch}-{self.seq}"
+
+    def _parse(self, cursor):
+        try:
+            epoch, seq = cursor.split("-")
+            return int(seq) if epoch == self.epoch else None
+        except (AttributeError, ValueError):
+            return None
+
+    def publish(self, class_id, payload):
+        # Thread-safe: may be called from request handlers or worker threads
+        with self.lock:
+            self.seq += 1
+            hist = self.history.setdefault(class_id, deque())
+            hist.append((self.seq, payload))
+            if len(hist) > self.history_size:
+                self.trimmed[class_id] = hist.popleft()[0]
+            event = (self.seq, payload)
+            for loop, queue in self.subscribers.get(class_id, ()):
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def subscribe(self, class_id, cursor = None):
+        """Returns (queue, backlog, reset). Backlog holds events after the cursor."""
+        queue = asyncio.Queue()
+        since = self._parse(cursor) if cursor else None
+        with self.lock:
+            self.subscribers.setdefault(class_id, set()).add((asyncio.get_running_loop(), queue))
+            hist = self.history.get(class_id, ())
+            reset = cursor is not None and (since is None or since < self.trimmed.get(class_id, 0))
+            backlog = [] if reset or since is None else [e for e in hist if e[0] > since]
+        return queue, backlog, reset
+
+    def unsubscribe(self, class_id, queue):
+        with self.lock:
+            subs = self.subscribers.get(class_id, set())
+            for entry in [e for e in subs if e[1] is queue]:
+                subs.discard(entry)
+
+    def _format(self, seq, event, payload):
+        return f"id: {self.epoch}-{seq}\nevent: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    async def stream(self, class_id, cursor = None, heartbeat = 15.0):
+        """Server-Sent Events generator for one client."""
+        queue, backlog, reset = self.subscribe(class_id, cursor)
+        try:
+            if reset:
+                yield self._format(self.seq, "reset", {})
+            for seq, payload in backlog:
+                yield self._format(seq, "attendance", payload)
+            while True:
+                try:
+                    seq, payload = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"  # keeps proxies from closing an idle stream
+                    continue
+                yield self._format(seq, "attendance", payload)
+        finally:
+            self.unsubscribe(class_id, queue)
@@ -0,0 +1,133 @@
+import io
+import os
+import time
+import pstats
+import cProfile
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, HTMLResponse
+
+# Seconds; covers a cached DB lookup up to a large class photo
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# --- PROFILING ---
+# With IRIS_PROFILING=1, a request sent with an "X-Profile: 1" header is profiled and the profile is
+# returned instead of the normal response (pyinstrument's sampling profiler if installed, else cProfile).
+# Only code running on the event loop thread is profiled, not work handed to thread pools.
+PROFILING = os.environ.get("IRIS_PROFILING", "0") == "1"
+PROFILE_HEADER = "x-profile"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    """Thread-safe histogram with one series per combination of label values."""
+
+    def __init__(self, name, help, labelnames, buckets = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series = {}  # label values -> [count per bucket..., overflow, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            s = self.series.get(labels)
+            if s is None:
+                s = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            s[bisect_left(self.buckets, value)] += 1  # le is inclusive
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self):
+        """Prometheus text exposition lines (buckets are cumulative)."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((k, list(v)) for k, v in self.series.items())
+        for labels, s in series:
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, labels))
+            total = 0
+            for le, count in zip(self.buckets, s):
+                total += count
+                lines.append(f'{self.name}_bucket{{{base},le="{le}"}} {total}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {s[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {s[-2]}")
+            lines.append(f"{self.name}_count{{{base}}} {s[-1]}")
+        return lines
+
+
+class Metrics:
+    """
+    Request and per-stage latency histograms for one service. instrument(app) adds the timing
+    middleware and GET /metrics; span("stage") times a block of code (any thread).
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.requests = Histogram("iris_http_request_duration_seconds", "HTTP request latency by route",
+                                  ("service", "method", "route", "status"))
+        self.stages = Histogram("iris_stage_duration_seconds", "Time spent in one stage of a request",
+                                ("service", "stage"))
+
+    def observe(self, stage, seconds):
+        self.stages.observe(seconds, self.service, stage)
+
+    @contextmanager
+    def span(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def render(self):
+        return "\n".join(self.requests.render() + self.stages.render()) + "\n"
+
+    def instrument(self, app: FastAPI):
+        @app.middleware("http")
+        async def timing(request: Request, call_next):
+            if PROFILING and request.headers.get(PROFILE_HEADER):
+                return await profile_request(request, call_next)
+            t0 = time.perf_counter()
+            status = 500
+            try:
+                response = await call_next(request)
+                status = response.status_code
+                return response
+            finally:
+                # Route template (e.g. /api/jobs/{job_id}) keeps the number of series bounded.
+                # Streaming responses (SSE, exports) are timed until their headers are sent.
+                route = getattr(request.scope.get("route"), "path", "unmatched")
+                self.requests.observe(time.perf_counter() - t0, self.service, request.method, route, str(status))
+
+        def metrics_endpoint():
+            return PlainTextResponse(self.render(), media_type = "text/plain; version=0.0.4")
+
+        app.add_api_route("/metrics", metrics_endpoint, methods = ["GET"], include_in_schema = False)
+
+
+async def profile_request(request: Request, call_next):
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+
+    if Profiler:
+        profiler = Profiler(async_mode = "enabled")
+        profiler.start()
+        await call_next(request)
+        profiler.stop()
+        return HTMLResponse(profiler.output_html())
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    await call_next(request)
+    profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream = out).sort_stats("cumulative").print_stats(50)
+    return PlainTextResponse(out.getvalue())
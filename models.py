@@ -1,4 +1,4 @@
-from sqlmodel import SQLModel, Field, Relationship
+from sqlmodel import SQLModel, Field, Relationship, Index
 from typing import List, Optional
 
 
@@ -23,6 +23,9 @@ class ClassRoom(SQLModel, table = True):
 
 
 class Student(SQLModel, table = True):
+    # Lookups by (class, roll) happen on every selfie, class photo and toggle
+    __table_args__ = (Index("ix_student_class_roll", "classroom_id", "roll_number"),)
+    
     id: Optional[int] = Field(default = None, primary_key = True)
     roll_number: str
     name: str
@@ -34,6 +37,14 @@ class Student(SQLModel, table = True):
 
 
 class Attendance(SQLModel, table = True):
+    # Keep in sync with db.migrate(), which adds these to databases created before they existed
+    __table_args__ = (
+        Index("ix_attendance_class_date", "classroom_id", "date"),
+        Index("ix_attendance_student_date", "student_id", "date"),
+        # One record per student/day/method (e.g. a second selfie the same day is ignored)
+        Index("uq_attendance_student_date_method", "student_id", "date", "method", unique = True),
+    )
+    
     id: Optional[int] = Field(default = None, primary_key = True)
     date: str
     time: str
@@ -45,4 +56,22 @@ class Attendance(SQLModel, table = True):
     
     # These 'back_populates' strings must match the variable names in the other classes exactly
     student: Student = Relationship(back_populates = "attendance_records")
-    classroom: ClassRoom = Relationship(back_populates = "attendance_records")
\ No newline at end of file
+    classroom: ClassRoom = Relationship(back_populates = "attendance_records")
+
+
+class PhotoJob(SQLModel, table = True):
+    # Class-photo processing job, see jobs.py. The same photo for the same class is only processed once.
+    __table_args__ = (Index("uq_photojob_class_hash", "classroom_id", "content_hash", unique = True),)
+    
+    id: Optional[int] = Field(default = None, primary_key = True)
+    classroom_id: int = Field(foreign_key = "classroom.id")
+    content_hash: str  # sha256 of the uploaded bytes
+    filename: str
+    image: Optional[bytes] = None  # dropped once the job has finished
+    status: str = "queued"  # "queued", "running", "done" or "failed"
+    stage: str = "Waiting in queue"
+    progress: float = 0.0  # 0..1
+    result: Optional[str] = None  # JSON: {"found": [...], "marked": [...], "stats": {...}}
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
\ No newline at end of file
@@ -0,0 +1,95 @@
+import os
+import csv
+import codecs
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import insert
+from sqlmodel import select
+from models import Student
+
+# --- BULK IMPORT ---
+# Roster CSV: roll,name[,folder]. Photos come in a ZIP with one folder per student, named by the
+# "folder" column, the roll number or stu_<roll> (nesting inside the ZIP does not matter).
+IMPORT_WORKERS = int(os.environ.get("IRIS_IMPORT_WORKERS", 8))  # students extracted in parallel
+INSERT_BATCH = 500  # Student rows per executemany/commit
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")  # same as face_store.IMAGE_EXTS
+
+
+def read_roster(fileobj):
+    """Yields {"row", "roll", "name", "folder"} from a binary CSV file; header names are case-insensitive."""
+    reader = csv.DictReader(codecs.iterdecode(fileobj, "utf-8-sig"))
+    for row_no, rec in enumerate(reader, start = 2):  # row 1 is the header
+        rec = {(k or "").strip().lower(): (v or "").strip() for k, v in rec.items()}
+        yield {"row": row_no, "roll": rec.get("roll") or rec.get("roll_number", ""), "name": rec.get("name", ""),
+               "folder": rec.get("folder", "")}
+
+
+def photo_folders(zf):
+    """Image members of the archive, grouped by the name of the folder they sit in."""
+    folders = {}
+    for info in zf.infolist():
+        parts = info.filename.replace("\\", "/").split("/")
+        if info.is_dir() or parts[0] == "__MACOSX" or len(parts) < 2: continue
+        if parts[-1].lower().endswith(IMAGE_EXTS):
+            folders.setdefault(parts[-2], []).append(info)
+    return folders
+
+
+def _extract(zf, members, dest):
+    # ZipFile serialises the raw reads on its shared handle; decompression runs in this thread
+    os.makedirs(dest, exist_ok = True)
+    for info in members:
+        name = os.path.basename(info.filename.replace("\\", "/"))  # never trust paths inside the archive
+        with zf.open(info) as src, open(os.path.join(dest, name), "wb") as out:
+            shutil.copyfileobj(src, out, 1 << 20)
+    return len(members)
+
+
+def import_roster(session, class_id: int, class_dir: str, roster, archive):
+    """
+    Add every valid roster row to the class: photos are streamed out of the ZIP (a file object,
+    never read whole) into student folders in parallel, then Students are inserted in batches.
+    Returns one report entry per roster row: {"row", "roll", "name", "ok", "photos", "error"}.
+    """
+    existing = set(session.exec(select(Student.roll_number).where(Student.classroom_id == class_id)).all())
+    report, todo, seen = [], [], set()
+
+    with zipfile.ZipFile(archive) as zf:
+        folders = photo_folders(zf)
+        for rec in read_roster(roster):
+            roll = rec["roll"]
+            entry = {"row": rec["row"], "roll": roll, "name": rec["name"], "ok": False, "photos": 0, "error": None}
+            report.append(entry)
+            members = folders.get(rec["folder"] or roll) or folders.get(f"stu_{roll}")
+            if not roll or not rec["name"]:
+                entry["error"] = "Missing roll number or name"
+            elif os.path.basename(roll) != roll or roll in (".", ".."):
+                entry["error"] = "Invalid roll number"
+            elif roll in existing:
+                entry["error"] = "Roll number already in this class"
+            elif roll in seen:
+                entry["error"] = "Duplicate roll number in roster"
+            elif not members:
+                entry["error"] = "No photos found in the archive"
+            else:
+                todo.append((entry, members))
+            seen.add(roll)
+
+        with ThreadPoolExecutor(max_workers = IMPORT_WORKERS, thread_name_prefix = "import") as ex:
+            jobs = [(entry, ex.submit(_extract, zf, members, os.path.join(class_dir, f"stu_{entry['roll']}")))
+                    for entry, members in todo]
+            for entry, job in jobs:
+                try:
+                    entry["photos"] = job.result()
+                except Exception as e:
+                    entry["error"] = f"Could not extract photos: {e}"
+
+    added = [entry for entry, _ in todo if not entry["error"]]
+    rows = [{"roll_number": e["roll"], "name": e["name"], "classroom_id": class_id,
+             "folder_path": os.path.join(class_dir, f"stu_{e['roll']}")} for e in added]
+    for i in range(0, len(rows), INSERT_BATCH):
+        session.execute(insert(Student), rows[i:i + INSERT_BATCH])
+        session.commit()
+    for e in added: e["ok"] = True
+    return report
@@ -0,0 +1,54 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- POOL SIZING ---
+# Each lane is a bounded thread pool, so a long class-photo job ("bulk") never sits in front
+# of a selfie ("interactive"). TensorFlow's own intra-op threads are capped so the lanes
+# together don't oversubscribe the CPU. These must be set before TensorFlow is imported.
+INTERACTIVE_WORKERS = int(os.environ.get("IRIS_INTERACTIVE_WORKERS", 2))
+BULK_WORKERS = int(os.environ.get("IRIS_BULK_WORKERS", 1))
+INTRA_OP_THREADS = int(os.environ.get("IRIS_INTRA_OP_THREADS",
+                                      max(1, (os.cpu_count() or 1) // (INTERACTIVE_WORKERS + BULK_WORKERS))))
+
+os.environ.setdefault("TF_NUM_INTRAOP_THREADS", str(INTRA_OP_THREADS))
+os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+os.environ.setdefault("OMP_NUM_THREADS", str(INTRA_OP_THREADS))
+
+
+class InferencePool:
+    def __init__(self, lanes = None):
+        self.sizes = lanes or {"interactive": INTERACTIVE_WORKERS, "bulk": BULK_WORKERS}
+        self.lanes = {}
+
+    async def start(self):
+        for name, size in self.sizes.items():
+            self.lanes[name] = ThreadPoolExecutor(max_workers = size, thread_name_prefix = f"infer-{name}")
+
+    async def run_on_every_worker(self, fn, *args):
+        """
+        Run fn(*args) once on every worker thread of every lane, e.g. to warm per-thread detectors
+        and interpreters. The barrier keeps all tasks of a lane in flight at once, otherwise an idle
+        thread would be reused and another never started.
+        """
+        loop = asyncio.get_running_loop()
+        for name, size in self.sizes.items():
+            barrier = threading.Barrier(size)
+
+            def task():
+                barrier.wait()
+                return fn(*args)
+
+            await asyncio.gather(*[loop.run_in_executor(self.lanes[name], task) for _ in range(size)])
+
+    def executor(self, lane):
+        return self.lanes[lane]
+
+    async def run(self, lane, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.lanes[lane], fn, *args)
+
+    def shutdown(self):
+        for ex in self.lanes.values():
+            ex.shutdown(wait = False, cancel_futures = True)
+        self.lanes = {}